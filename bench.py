@@ -0,0 +1,445 @@
+"""Нагрузочный прогон bot.py без Telegram.
+
+Поднимает локальную заглушку Bot API (задержка, случайные 429 RetryAfter,
+запись всех вызовов), запускает настоящий Application из bot.build_app
+и подаёт в него синтетический или записанный поток апдейтов.
+
+    python bench.py --rate 500 --count 10000
+    python bench.py --replay updates.jsonl --latency 0.05 --retry-rate 0.02
+    python bench.py --count 2000 --dump updates.jsonl   # сохранить поток для повторов
+
+Отчёт: пропускная способность, p50/p99 задержки апдейтов и обработчиков,
+вызовы API на апдейт, пиковая память и число живых задач.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import parse_qsl
+
+# bot.py читает окружение при импорте: база, конфиг и журнал - во временной папке, /metrics не нужен
+WORKDIR = tempfile.mkdtemp(prefix="bench-")
+os.environ["BOT_DB"] = os.path.join(WORKDIR, "bench.db")
+os.environ["BOT_CONFIG"] = os.path.join(WORKDIR, "config.json")
+os.environ["BOT_AUDIT_DIR"] = os.path.join(WORKDIR, "audit")
+os.environ["METRICS_PORT"] = "0"
+
+import bot
+from telegram import Update
+
+BENCH_TOKEN = "123456:BENCH"
+BOT_ID = 123456
+ADMIN_ID = bot.ADMINS[0]
+
+# ==================== ЗАГЛУШКА BOT API ====================
+# Методы, которые «отправляют» и поэтому могут получить 429
+SEND_METHODS = {"sendMessage", "editMessageText", "sendAnimation", "sendPhoto"}
+
+def parse_params(headers, body):
+    """Параметры вызова: PTB шлёт форму, где значения закодированы в JSON"""
+    if headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body or b"{}")
+    params = {}
+    for name, value in parse_qsl(body.decode()):
+        try:
+            params[name] = json.loads(value)
+        except ValueError:
+            params[name] = value
+    return params
+
+class FakeBotAPI:
+    """HTTP-сервер, отвечающий как Bot API, в отдельном потоке со своим циклом
+
+    Отдельный цикл нужен, чтобы заглушка не отнимала время у цикла бота
+    и задержки обработчиков не искажались её собственной работой.
+    """
+
+    def __init__(self, latency=0.03, retry_rate=0.0, retry_after=1, seed=0):
+        self.latency = latency
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.retries = Counter()
+        self.next_message_id = 1 << 20
+        self.port = None
+        self.loop = None
+        self.server = None
+        self.ready = threading.Event()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}/bot"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="fake-bot-api", daemon=True).start()
+        self.ready.wait()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def close(self):
+        self.server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def serve_forever(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.handle, "127.0.0.1", 0))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.ready.set()
+        self.loop.run_forever()
+
+    async def handle(self, reader, writer):
+        # httpx держит соединения открытыми, поэтому отвечаем на несколько запросов подряд
+        try:
+            while True:
+                method, path, headers, body = await bot.read_http_request(reader)
+                if not method:
+                    break
+                status, payload = await self.call(path.rsplit("/", 1)[-1], parse_params(headers, body))
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def call(self, name, params):
+        self.calls[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.random.uniform(0.5, 1.5))
+        if name in SEND_METHODS and self.random.random() < self.retry_rate:
+            self.retries[name] += 1
+            return "429 Too Many Requests", {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+        return "200 OK", {"ok": True, "result": self.result(name, params)}
+
+    def result(self, name, params):
+        me = {"id": BOT_ID, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        chat_id = int(params.get("chat_id") or 0)
+        if name == "getMe":
+            return dict(me, can_join_groups=True, can_read_all_group_messages=True, supports_inline_queries=True)
+        if name in SEND_METHODS:
+            self.next_message_id += 1
+            return {
+                "message_id": params.get("message_id") or self.next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+                "from": me,
+                "text": params.get("text", ""),
+            }
+        if name == "getChatAdministrators":
+            return [{"status": "creator", "is_anonymous": False, "user": user_dict(ADMIN_ID)}]
+        if name == "getChatMember":
+            return {"status": "member", "user": user_dict(int(params.get("user_id") or 0))}
+        if name == "getChat":
+            return {"id": chat_id, "type": "supergroup", "title": "bench"}
+        if name == "getChatMemberCount":
+            return 100
+        return True
+
+# ==================== ПОТОК АПДЕЙТОВ ====================
+# Доли типов апдейтов в синтетическом потоке
+DEFAULT_MIX = {
+    "chatter": 0.5,
+    "keyword": 0.15,
+    "username": 0.1,
+    "join": 0.08,
+    "callback": 0.08,
+    "admin": 0.04,
+    "inline": 0.05,
+}
+
+CHATTER = [
+    "привет всем", "кто-нибудь пробовал новую версию?", "спасибо, помогло",
+    "а когда будет обновление", "у меня не работает оплата картой",
+    "подскажите пожалуйста по тарифам", "ок", "👍", "всё пришло, спасибо",
+]
+# Из этих слов добавляется хвост к длинным сообщениям: живые люди не пишут
+# слово в слово одно и то же, а одинаковый текст от многих авторов - это рассылка
+CHATTER_WORDS = (
+    "вчера сегодня карта банк перевод заказ номер деньги вернули ждал долго "
+    "поддержка ответила быстро медленно комиссия курс доллар рубль юань тариф "
+    "подписка продлить отменить аккаунт почта пароль код пришёл потерял нашёл "
+    "друг посоветовал работает нормально странно опять снова уже наконец"
+).split()
+CALLBACKS = ["accounts", "how_pay", "alipay", "pay_gpt", "pay_suno", "pay_google", "main"]
+ADMIN_COMMANDS = ["/stats", "/check @{name}", "/chatinfo", "/delete"]
+
+def user_dict(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"user{user_id}"}
+
+class UpdateFactory:
+    """Синтетические апдейты: входы, ключевые слова, @ники, кнопки, inline-запросы, команды админов"""
+
+    def __init__(self, chats=50, users=5000, mix=None, seed=0):
+        self.random = random.Random(seed)
+        self.chats = [-1001000000000 - i for i in range(chats)]
+        self.users = [10_000 + i for i in range(users)]
+        self.kinds, self.weights = zip(*(mix or DEFAULT_MIX).items())
+        self.update_id = 0
+        self.message_ids = Counter()
+        self.official = sorted(bot.config.official) or ["official"]
+        self.triggers = sorted(bot.DEFAULT_TRIGGERS)
+
+    def message(self, chat_id, user_id, text=None, **extra):
+        self.message_ids[chat_id] += 1
+        msg = {
+            "message_id": self.message_ids[chat_id],
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"chat {chat_id}"},
+            "from": user_dict(user_id),
+        }
+        if text is not None:
+            msg["text"] = text
+            if text.startswith("/"):
+                msg["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        msg.update(extra)
+        return msg
+
+    def make(self):
+        self.update_id += 1
+        kind = self.random.choices(self.kinds, self.weights)[0]
+        chat_id = self.random.choice(self.chats)
+        user_id = self.random.choice(self.users)
+        update = {"update_id": self.update_id}
+
+        if kind == "join":
+            update["message"] = self.message(chat_id, user_id, new_chat_members=[user_dict(user_id)])
+        elif kind == "keyword":
+            text = f"{self.random.choice(self.triggers)} {self.random.choice(CHATTER)}"
+            update["message"] = self.message(chat_id, user_id, text)
+        elif kind == "username":
+            # Один @ник без текста - только так text_router доходит до check_username.
+            # Поровну настоящих, похожих подделок и незнакомых ников
+            name = self.random.choice(self.official).lstrip("@")
+            roll = self.random.random()
+            if roll < 1 / 3:
+                name = name[:-1] + "x"
+            elif roll < 2 / 3:
+                name = f"user{user_id}"
+            update["message"] = self.message(chat_id, user_id, f"@{name}")
+        elif kind == "callback":
+            sent = self.message(chat_id, BOT_ID, "меню")
+            sent["from"] = {"id": BOT_ID, "is_bot": True, "first_name": "Bench"}
+            update["callback_query"] = {
+                "id": str(self.update_id),
+                "from": user_dict(user_id),
+                "chat_instance": str(chat_id),
+                "data": self.random.choice(CALLBACKS),
+                "message": sent,
+            }
+        elif kind == "inline":
+            name = self.random.choice(self.official)
+            update["inline_query"] = {
+                "id": str(self.update_id),
+                "from": user_dict(user_id),
+                "query": name[:self.random.randint(1, len(name))],
+                "offset": "",
+            }
+        elif kind == "admin":
+            text = self.random.choice(ADMIN_COMMANDS).format(name=self.random.choice(self.official))
+            target = self.message(chat_id, user_id, self.random.choice(CHATTER))
+            update["message"] = self.message(chat_id, ADMIN_ID, text, reply_to_message=target)
+        else:
+            update["message"] = self.message(chat_id, user_id, self.chatter())
+        return update
+
+    def chatter(self):
+        text = self.random.choice(CHATTER)
+        if len(text) >= 20 or self.random.random() < 0.5:
+            text += ", " + " ".join(self.random.sample(CHATTER_WORDS, self.random.randint(3, 6)))
+        return text
+
+def load_replay(path):
+    """Записанный поток: по одному апдейту (JSON, как из getUpdates) на строку"""
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# ==================== ЗАМЕРЫ ====================
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+class Probe:
+    """Точные задержки апдейтов и обработчиков плюс пики задач"""
+
+    def __init__(self):
+        self.enqueued = {}
+        self.update_latency = []
+        self.handler_latency = {}
+        self.peak_tasks = 0
+        self.last_done = 0.0
+
+    def wrap_processor(self, processor):
+        # Задержка апдейта - от постановки в очередь до конца всех обработчиков
+        process = processor.process_update
+
+        async def wrapper(update, coroutine):
+            try:
+                await process(update, coroutine)
+            finally:
+                start = self.enqueued.pop(getattr(update, "update_id", None), None)
+                if start is not None:
+                    self.last_done = time.perf_counter()
+                    self.update_latency.append(self.last_done - start)
+
+        processor.process_update = wrapper
+
+    def wrap_handlers(self, app):
+        for handlers in app.handlers.values():
+            for handler in handlers:
+                handler.callback = self.timed(handler.callback)
+
+    def timed(self, callback):
+        samples = self.handler_latency.setdefault(callback.__name__, [])
+
+        async def wrapper(update, context):
+            start = time.perf_counter()
+            try:
+                return await callback(update, context)
+            finally:
+                samples.append(time.perf_counter() - start)
+
+        wrapper.__name__ = callback.__name__
+        return wrapper
+
+    async def sample_tasks(self, interval=0.01):
+        while True:
+            self.peak_tasks = max(self.peak_tasks, len(asyncio.all_tasks()))
+            await asyncio.sleep(interval)
+
+async def wait_idle(app, probe, timeout):
+    """Ждёт, пока обработаются все апдейты и уйдут все отправки"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if not probe.enqueued and app.update_queue.empty() and not len(bot.sender):
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+# ==================== ПРОГОН ====================
+async def run(args, updates, api):
+    app = bot.build_app(BENCH_TOKEN, base_url=api.base_url)
+    probe = Probe()
+    probe.wrap_handlers(app)
+    probe.wrap_processor(app.update_processor)
+
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    sampler = asyncio.create_task(probe.sample_tasks())
+
+    # Апдейты подаются пачками каждые 10 мс, чтобы держать заданный темп
+    tick = 0.01
+    per_tick = max(1, round(args.rate * tick))
+    start = time.perf_counter()
+    for i in range(0, len(updates), per_tick):
+        due = start + (i // per_tick) * tick
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        for data in updates[i:i + per_tick]:
+            update = Update.de_json(data, app.bot)
+            probe.enqueued[update.update_id] = time.perf_counter()
+            await app.update_queue.put(update)
+    fed = time.perf_counter() - start
+
+    idle = await wait_idle(app, probe, args.timeout)
+    elapsed = time.perf_counter() - start
+    sampler.cancel()
+
+    await app.stop()
+    await app.post_stop(app)
+    await app.shutdown()
+    return probe, fed, probe.last_done - start, elapsed, idle
+
+def report(args, updates, api, probe, fed, processing, elapsed, idle):
+    total_calls = sum(api.calls.values())
+    processed = len(probe.update_latency)
+    ms = lambda v: f"{v * 1000:.1f} ms"
+    lines = [
+        f"Апдейтов: {len(updates)} (обработано {processed}), темп подачи {args.rate}/с",
+        f"Подача: {fed:.2f} с, обработка: {processing:.2f} с, "
+        f"до опустошения очереди отправки: {elapsed:.2f} с" + ("" if idle else " (таймаут!)"),
+        f"Пропускная способность: {processed / max(processing, 1e-9):.0f} апдейтов/с",
+        f"Задержка апдейта: p50 {ms(percentile(probe.update_latency, 0.5))}, "
+        f"p99 {ms(percentile(probe.update_latency, 0.99))}, max {ms(max(probe.update_latency, default=0))}",
+        f"Вызовов API: {total_calls} ({total_calls / max(1, len(updates)):.2f} на апдейт), "
+        f"ответов 429: {sum(api.retries.values())}",
+        f"Пик памяти (RSS): {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ",
+        f"Пик задач asyncio: {probe.peak_tasks}",
+        "",
+        "Обработчики (вызовов, p50, p99):",
+    ]
+    for name, samples in sorted(probe.handler_latency.items(), key=lambda kv: -len(kv[1])):
+        if samples:
+            lines.append(f"  {name:24} {len(samples):7} {ms(percentile(samples, 0.5)):>10} {ms(percentile(samples, 0.99)):>10}")
+    lines += ["", "Методы API:"]
+    lines += [f"  {name:24} {n:7}" for name, n in api.calls.most_common()]
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон bot.py против заглушки Bot API")
+    parser.add_argument("--rate", type=float, default=500, help="апдейтов в секунду")
+    parser.add_argument("--count", type=int, default=5000, help="сколько синтетических апдейтов")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--replay", help="JSONL с записанными апдейтами вместо синтетики")
+    parser.add_argument("--dump", help="сохранить поданные апдейты в JSONL")
+    parser.add_argument("--latency", type=float, default=0.03, help="средняя задержка ответа API, с")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="доля отправок, получающих 429")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=120, help="сколько ждать опустошения очередей")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="дописать отчёт в файл")
+    args = parser.parse_args()
+    # Лог каждого запроса к заглушке сам по себе стал бы нагрузкой
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    if args.replay:
+        updates = load_replay(args.replay)
+    else:
+        factory = UpdateFactory(args.chats, args.users, seed=args.seed)
+        updates = [factory.make() for _ in range(args.count)]
+    if args.dump:
+        with open(args.dump, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(u, ensure_ascii=False) + "\n" for u in updates)
+
+    api = FakeBotAPI(args.latency, args.retry_rate, args.retry_after, args.seed)
+    api.start()
+    try:
+        result = asyncio.run(run(args, updates, api))
+    finally:
+        api.stop()
+
+    text = report(args, updates, api, *result)
+    print(text)
+    if args.output:
+        with open(args.output, "a", encoding="utf-8") as f:
+            f.write(text + "\n\n")
+
+if __name__ == "__main__":
+    main()
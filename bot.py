@@ -1,18 +1,47 @@
 import logging
 import os
+import signal
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMemberAdministrator, ChatMemberOwner
+import bisect
+import contextlib
+import fcntl
+import functools
+import gzip
+import heapq
+import hmac
+import json
+import sqlite3
+import time
+import unicodedata
+import zlib
+from collections import OrderedDict, deque
+from telegram import (
+    Update,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    ChatPermissions,
+)
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     CallbackQueryHandler,
+    ChatMemberHandler,
+    InlineQueryHandler,
+    ApplicationHandlerStop,
     ContextTypes,
+    TypeHandler,
     filters,
 )
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 
 TOKEN = os.getenv("BOT_TOKEN")
 
+# Значения по умолчанию: рабочие списки живут в config (см. ConfigStore)
 ADMINS = [481650304, 7668402802]
 
 OFFICIAL_USERS = {
@@ -27,7 +56,7 @@ OFFICIAL_USERS = {
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DELETE_AFTER = 120
+DELETE_AFTER = 120  # по умолчанию; чат может задать свой delete_after в профиле
 
 # ==================== СТАТИСТИКА ====================
 STATS = {
@@ -37,16 +66,464 @@ STATS = {
     "bans_issued": 0,
     "kicks_issued": 0,
     "admins_actions": 0,
-    "checks_performed": 0
+    "checks_performed": 0,
+    "inline_queries": 0  # Telegram шлёт запрос на каждое нажатие клавиши - это не проверки
 }
 
-async def delete_later(message):
-    """Удаляет сообщение с задержкой"""
-    await asyncio.sleep(DELETE_AFTER)
-    try:
-        await message.delete()
-    except:
-        pass
+# ==================== ОТЛОЖЕННОЕ УДАЛЕНИЕ ====================
+DB_PATH = os.getenv("BOT_DB", "bot.db")
+DELETE_BATCH = 100  # максимум id в одном запросе deleteMessages
+DELETE_TICK = 1  # как часто (в секундах) проверяется очередь удаления
+DELETE_RETRY = 10  # через сколько секунд повторить пачку после сетевой ошибки
+
+_db = None
+
+def get_db():
+    """Общее подключение к SQLite (открывается при первом обращении)"""
+    global _db
+    if _db is None:
+        _db = sqlite3.connect(DB_PATH)
+    return _db
+
+class DeleteScheduler:
+    """Единая очередь отложенного удаления.
+
+    Хранит только (время, chat_id, message_id) в куче, дублирует их в SQLite,
+    чтобы удаления переживали перезапуск, и удаляет пачками через deleteMessages.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.unsaved = []
+        self.task = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def load(self):
+        db = get_db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS pending_deletes ("
+            "chat_id INTEGER, message_id INTEGER, due REAL, "
+            "PRIMARY KEY (chat_id, message_id))"
+        )
+        rows = db.execute("SELECT due, chat_id, message_id FROM pending_deletes").fetchall()
+        self.heap = [tuple(r) for r in rows]
+        heapq.heapify(self.heap)
+
+    def schedule(self, message, delay=None):
+        """Ставит сообщение в очередь на удаление через delay (по умолчанию DELETE_AFTER)"""
+        if message is None:
+            return
+        due = time.time() + (DELETE_AFTER if delay is None else delay)
+        item = (due, message.chat_id, message.message_id)
+        heapq.heappush(self.heap, item)
+        self.unsaved.append(item)
+
+    def save(self):
+        if self.unsaved:
+            get_db().executemany(
+                "INSERT OR REPLACE INTO pending_deletes (due, chat_id, message_id) VALUES (?, ?, ?)",
+                self.unsaved
+            )
+            self.unsaved.clear()
+        get_db().commit()
+
+    async def flush(self, bot):
+        self.save()
+        now = time.time()
+        due = {}
+        while self.heap and self.heap[0][0] <= now:
+            _, chat_id, message_id = heapq.heappop(self.heap)
+            due.setdefault(chat_id, []).append(message_id)
+        
+        done = []
+        for chat_id, ids in due.items():
+            for i in range(0, len(ids), DELETE_BATCH):
+                batch = ids[i:i + DELETE_BATCH]
+                try:
+                    await bot.delete_messages(chat_id, batch)
+                except (RetryAfter, NetworkError) as e:
+                    # BadRequest - тоже NetworkError, но повтор ему не поможет
+                    if isinstance(e, BadRequest):
+                        logger.debug("deleteMessages в %s не удался: %s", chat_id, e)
+                    else:
+                        retry = time.time() + getattr(e, "retry_after", DELETE_RETRY)
+                        for message_id in batch:
+                            heapq.heappush(self.heap, (retry, chat_id, message_id))
+                        continue
+                except TelegramError as e:
+                    # Forbidden и прочее: бота нет в чате, удалять уже нечего
+                    logger.debug("deleteMessages в %s не удался: %s", chat_id, e)
+                done.extend((chat_id, message_id) for message_id in batch)
+        
+        if done:
+            get_db().executemany(
+                "DELETE FROM pending_deletes WHERE chat_id = ? AND message_id = ?", done
+            )
+            get_db().commit()
+
+    async def run(self, bot):
+        while True:
+            await asyncio.sleep(DELETE_TICK)
+            try:
+                await self.flush(bot)
+            except Exception:
+                logger.exception("Ошибка очереди удаления")
+
+deleter = DeleteScheduler()
+
+# ==================== ХРАНИЛИЩЕ СТАТИСТИКИ ====================
+STATS_FLUSH = 5  # как часто (в секундах) счётчики пишутся в SQLite
+STATS_KEEP_MINUTES = 2 * 3600  # сколько хранить поминутные корзины
+STATS_KEEP_HOURS = 8 * 86400  # сколько хранить почасовые корзины
+
+# Таблица -> размер корзины в секундах; дневные корзины хранятся всегда
+STATS_TABLES = {"stats_minute": 60, "stats_hour": 3600, "stats_day": 86400}
+
+class StatsStore:
+    """Счётчики по чатам в корзинах минута/час/день.
+
+    В памяти копятся только приращения за последние секунды, в SQLite они
+    уходят одной транзакцией сразу во все три уровня, так что запросы за
+    час/сутки/неделю читают уже свёрнутые корзины.
+    """
+
+    def __init__(self):
+        self.pending = {}  # (chat_id, минута, счётчик) -> приращение
+        self.task = None
+
+    def load(self):
+        db = get_db()
+        for table in STATS_TABLES:
+            db.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "bucket INTEGER, chat_id INTEGER, name TEXT, value INTEGER, "
+                "PRIMARY KEY (bucket, chat_id, name)) WITHOUT ROWID"
+            )
+        for name, value in db.execute("SELECT name, SUM(value) FROM stats_day GROUP BY name"):
+            STATS[name] = value
+
+    def hit(self, name, chat_id=None, n=1):
+        STATS[name] = STATS.get(name, 0) + n
+        key = (chat_id or 0, int(time.time()) // 60, name)
+        self.pending[key] = self.pending.get(key, 0) + n
+
+    def save(self):
+        if not self.pending:
+            return
+        rows = self.pending
+        self.pending = {}
+        db = get_db()
+        for table, size in STATS_TABLES.items():
+            merged = {}
+            for (chat_id, minute, name), value in rows.items():
+                key = (minute * 60 // size, chat_id, name)
+                merged[key] = merged.get(key, 0) + value
+            db.executemany(
+                f"INSERT INTO {table} (bucket, chat_id, name, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (bucket, chat_id, name) DO UPDATE SET value = value + excluded.value",
+                [(*key, value) for key, value in merged.items()]
+            )
+        now = int(time.time())
+        db.execute("DELETE FROM stats_minute WHERE bucket < ?", ((now - STATS_KEEP_MINUTES) // 60,))
+        db.execute("DELETE FROM stats_hour WHERE bucket < ?", ((now - STATS_KEEP_HOURS) // 3600,))
+        db.commit()
+
+    def totals(self, seconds):
+        """Счётчики за последние seconds: час - по минутам, сутки - по часам, дальше - по дням"""
+        self.save()
+        if seconds <= 3600:
+            table, size = "stats_minute", 60
+        elif seconds <= 86400:
+            table, size = "stats_hour", 3600
+        else:
+            table, size = "stats_day", 86400
+        since = (int(time.time()) - seconds) // size + 1
+        rows = get_db().execute(
+            f"SELECT name, SUM(value) FROM {table} WHERE bucket >= ? GROUP BY name", (since,)
+        )
+        return dict(rows.fetchall())
+
+    def top_chats(self, name="messages_processed", days=7, limit=5):
+        self.save()
+        since = int(time.time()) // 86400 - days + 1
+        return get_db().execute(
+            "SELECT chat_id, SUM(value) AS total FROM stats_day "
+            "WHERE bucket >= ? AND name = ? AND chat_id != 0 "
+            "GROUP BY chat_id ORDER BY total DESC LIMIT ?",
+            (since, name, limit)
+        ).fetchall()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(STATS_FLUSH)
+            try:
+                self.save()
+            except Exception:
+                logger.exception("Ошибка записи статистики")
+
+stats = StatsStore()
+
+def render_periods():
+    """Блок статистики за час / 24 ч / 7 дн и топ чатов"""
+    periods = [stats.totals(3600), stats.totals(86400), stats.totals(7 * 86400)]
+    
+    def row(title, name):
+        return f"{title}: " + " / ".join(str(p.get(name, 0)) for p in periods)
+    
+    lines = [
+        "⏱ За час / 24 ч / 7 дн:",
+        row("📨 Сообщений", "messages_processed"),
+        row("🔑 Ключевых слов", "keywords_triggered"),
+        row("👋 Приветствий", "welcome_messages"),
+        row("🚫 Банов", "bans_issued"),
+        row("✅ Проверок", "checks_performed"),
+    ]
+    top = stats.top_chats()
+    if top:
+        lines.append("\n🏆 Топ чатов за 7 дн:")
+        lines.extend(f"• {chat_id}: {total}" for chat_id, total in top)
+    return "\n".join(lines)
+
+# ==================== ОЧЕРЕДЬ ОТПРАВКИ ====================
+PRIO_ADMIN = 0  # подтверждения модерации
+PRIO_NORMAL = 1  # проверки, меню, статистика
+PRIO_LOW = 2  # ключевые слова и приветствия
+
+GLOBAL_RATE = 30  # сообщений в секунду на всего бота
+GROUP_RATE = 20 / 60  # сообщений в секунду на одну группу
+PRIVATE_RATE = 1  # сообщений в секунду в личный чат
+CHAT_BURST = 3
+DEDUP_WINDOW = 5  # секунд, в течение которых одинаковый ответ считается повтором
+SEND_BACKLOG = 50  # длина очереди, после которой повторы низкого приоритета отбрасываются
+SEND_DRAIN_TIMEOUT = 10  # сколько секунд при остановке досылать очередь
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = time.monotonic()
+
+    def wait_time(self, now):
+        """Сколько секунд ждать до появления токена (0 - можно отправлять)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds):
+        """Блокирует ведро на seconds (используется при RetryAfter)"""
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+class SendJob:
+    __slots__ = ("chat_id", "func", "future", "autodelete", "key")
+
+    def __init__(self, chat_id, func, future, autodelete, key):
+        self.chat_id = chat_id
+        self.func = func
+        self.future = future
+        self.autodelete = autodelete
+        self.key = key
+
+class Sender:
+    """Единая очередь исходящих сообщений.
+
+    Ограничивает скорость глобально и по каждому чату (token bucket),
+    отправляет по приоритету, сама обрабатывает RetryAfter и склеивает
+    одинаковые ответы низкого приоритета.
+    
+    У каждого чата своя куча заданий. В общей куче ready лежат головы
+    чатов, которые можно обслужить сейчас, чаты, упёршиеся в лимит,
+    ждут в waiting до момента, когда у них появится токен. Так выбор
+    следующего задания стоит O(log n), даже если почти все чаты заблокированы.
+    """
+
+    def __init__(self):
+        self.chats = {}  # chat_id -> куча (приоритет, seq, задание)
+        self.ready = []  # (приоритет, seq, chat_id) головы незаблокированных чатов
+        self.waiting = []  # (когда появится токен, chat_id)
+        self.parked = set()  # чаты, лежащие в waiting
+        self.size = 0
+        self.seq = 0
+        self.buckets = {}
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+        self.queued = {}
+        self.recent = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.inflight = set()
+        self.bot = None
+        self.task = None
+
+    def __len__(self):
+        return self.size
+
+    def bucket(self, chat_id):
+        b = self.buckets.get(chat_id)
+        if b is None:
+            if len(self.buckets) > 10000:
+                self.prune_buckets()
+            b = TokenBucket(GROUP_RATE if chat_id < 0 else PRIVATE_RATE, CHAT_BURST)
+            self.buckets[chat_id] = b
+        return b
+
+    def prune_buckets(self):
+        now = time.monotonic()
+        for chat_id, b in list(self.buckets.items()):
+            if b.wait_time(now) == 0 and b.tokens >= b.capacity:
+                del self.buckets[chat_id]
+
+    def submit(self, chat_id, func, priority=PRIO_NORMAL, autodelete=False, key=None):
+        """Ставит вызов Bot API в очередь, возвращает Future с результатом (или None)"""
+        loop = asyncio.get_running_loop()
+        if key is not None:
+            job = self.queued.get(key)
+            if job is not None:
+                return job.future
+            now = time.monotonic()
+            while self.recent and next(iter(self.recent.values())) < now - DEDUP_WINDOW:
+                self.recent.popitem(last=False)
+            if key in self.recent and self.size >= SEND_BACKLOG:
+                future = loop.create_future()
+                future.set_result(None)
+                return future
+
+        job = SendJob(chat_id, func, loop.create_future(), autodelete, key)
+        if key is not None:
+            self.queued[key] = job
+        self.push(priority, job)
+        return job.future
+
+    def reply(self, message, text, priority=PRIO_NORMAL, autodelete=False, dedup=False, **kwargs):
+        """Ответ на сообщение через очередь; dedup склеивает одинаковые ответы в чате"""
+        key = (message.chat_id, text) if dedup else None
+        return self.submit(
+            message.chat_id,
+            lambda: message.reply_text(text, **kwargs),
+            priority=priority,
+            autodelete=autodelete,
+            key=key
+        )
+
+    def send(self, chat_id, text, priority=PRIO_NORMAL, autodelete=False, **kwargs):
+        """Новое сообщение в чат через очередь (когда отвечать не на что)"""
+        return self.submit(
+            chat_id,
+            lambda: self.bot.send_message(chat_id, text, **kwargs),
+            priority=priority,
+            autodelete=autodelete
+        )
+
+    def push(self, priority, job):
+        self.seq += 1
+        item = (priority, self.seq, job)
+        queue = self.chats.setdefault(job.chat_id, [])
+        heapq.heappush(queue, item)
+        self.size += 1
+        if queue[0] is item:
+            self.activate(job.chat_id)
+        self.wakeup.set()
+
+    def activate(self, chat_id):
+        """Кладёт текущую голову чата в ready (старые записи чата становятся устаревшими)"""
+        if chat_id in self.parked:
+            return
+        priority, seq, _ = self.chats[chat_id][0]
+        heapq.heappush(self.ready, (priority, seq, chat_id))
+
+    def next_job(self, now):
+        """Достаёт самое приоритетное задание, чат которого не упёрся в лимит"""
+        while self.waiting and self.waiting[0][0] <= now:
+            _, chat_id = heapq.heappop(self.waiting)
+            self.parked.discard(chat_id)
+            if chat_id in self.chats:
+                self.activate(chat_id)
+        
+        while self.ready:
+            _, seq, chat_id = heapq.heappop(self.ready)
+            queue = self.chats.get(chat_id)
+            if not queue or queue[0][1] != seq:
+                continue  # голова чата уже сменилась
+            wait = self.bucket(chat_id).wait_time(now)
+            if wait:
+                self.parked.add(chat_id)
+                heapq.heappush(self.waiting, (now + wait, chat_id))
+                continue
+            item = heapq.heappop(queue)
+            self.size -= 1
+            if queue:
+                self.activate(chat_id)
+            else:
+                del self.chats[chat_id]
+            return item, None
+        
+        return None, (self.waiting[0][0] - now if self.waiting else None)
+
+    async def drain(self, timeout):
+        """Ждёт, пока уйдёт всё, что уже стоит в очереди (при остановке бота)"""
+        deadline = time.monotonic() + timeout
+        while (self.size or self.inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.size:
+            logger.warning("При остановке не отправлено %s сообщений", self.size)
+
+    async def run(self):
+        while True:
+            if not self.size:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            
+            now = time.monotonic()
+            wait = self.global_bucket.wait_time(now)
+            if wait:
+                await asyncio.sleep(wait)
+                continue
+            
+            item, wait = self.next_job(now)
+            if item is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            priority, _, job = item
+            self.global_bucket.take()
+            self.bucket(job.chat_id).take()
+            task = asyncio.create_task(self.deliver(priority, job))
+            self.inflight.add(task)
+            task.add_done_callback(self.inflight.discard)
+
+    async def deliver(self, priority, job):
+        try:
+            result = await job.func()
+        except RetryAfter as e:
+            logger.warning("RetryAfter %s с в чате %s", e.retry_after, job.chat_id)
+            self.bucket(job.chat_id).pause(e.retry_after)
+            return self.push(priority, job)
+        except Exception as e:
+            logger.warning("Не удалось отправить сообщение в %s: %s", job.chat_id, e)
+            result = None
+        
+        if job.key is not None:
+            self.queued.pop(job.key, None)
+            self.recent[job.key] = time.monotonic()
+            self.recent.move_to_end(job.key)
+        if job.autodelete:
+            deleter.schedule(result, chat_rules.get(job.chat_id).delete_after)
+        if not job.future.done():
+            job.future.set_result(result)
+
+sender = Sender()
 
 KEYWORD_TEXT = (
     "Уважаемый клиент, обратитесь в один из аккаунтов:\n"
@@ -111,205 +588,1668 @@ ADMIN_PANEL = InlineKeyboardMarkup([
     [InlineKeyboardButton("📝 Изменить тексты", callback_data="admin_edit")],
 ])
 
-async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    for user in update.message.new_chat_members:
-        STATS["welcome_messages"] += 1
-        name = user.first_name or "клиент"
-        msg = await update.message.reply_text(
-            WELCOME_TEXT.format(username=name),
-            reply_markup=MAIN_BUTTONS
+# ==================== НАСТРОЙКИ ====================
+CONFIG_PATH = os.getenv("BOT_CONFIG", "config.json")
+CONFIG_POLL = 2  # как часто (в секундах) проверять, не изменился ли файл
+
+# Редактируемые тексты (ключи совпадают с /settext и блоками /trigger)
+DEFAULT_TEXTS = {
+    "keywords": KEYWORD_TEXT,
+    "pay": PAY_GUIDE,
+    "gpt": GPT_TEXT,
+    "suno": SUNO_TEXT,
+    "google": GOOGLE_TEXT,
+    "welcome": WELCOME_TEXT,
+}
+
+def render_welcome(text, username):
+    """Приветствие с именем; остальные фигурные скобки в тексте админа - просто текст"""
+    return text.replace("{username}", username)
+
+class Config:
+    """Неизменяемый снимок настроек; подменяется целиком с новой версией"""
+
+    __slots__ = ("version", "admins", "official", "texts", "chats")
+
+    def __init__(self, version, admins, official, texts, chats=None):
+        self.version = version
+        self.admins = frozenset(admins)
+        self.official = dict(official)
+        self.texts = {**DEFAULT_TEXTS, **texts}
+        # Профили чатов; в JSON ключи - строки
+        self.chats = {int(chat_id): profile for chat_id, profile in (chats or {}).items()}
+
+    def to_json(self):
+        return {
+            "version": self.version,
+            "admins": sorted(self.admins),
+            "official": self.official,
+            "texts": self.texts,
+            "chats": {str(chat_id): profile for chat_id, profile in self.chats.items()},
+        }
+
+config = Config(0, ADMINS, OFFICIAL_USERS, DEFAULT_TEXTS)
+
+def is_admin(user_id):
+    return user_id in config.admins
+
+class ConfigStore:
+    """Админы, официальные аккаунты, тексты и профили чатов в JSON-файле.
+
+    Файл можно делить между несколькими процессами бота: запись атомарная
+    (временный файл + os.replace) и идёт под flock на соседнем .lock-файле,
+    а каждый процесс подхватывает чужие изменения по mtime без перезапуска.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+        self.task = None
+
+    @contextlib.contextmanager
+    def locked(self):
+        # Блокируем отдельный файл: сам config.json при записи подменяется новым
+        with open(f"{self.path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def read(self):
+        global config
+        st = os.stat(self.path)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self.stamp:
+            return
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.stamp = stamp
+        fresh = Config(
+            data.get("version", 0),
+            data["admins"],
+            data["official"],
+            data.get("texts", {}),
+            data.get("chats", {})
+        )
+        if fresh.to_json() == config.to_json():
+            return
+        # Кэши сбрасываются по версии, поэтому изменённое содержимое всегда получает новую
+        if fresh.version <= config.version:
+            fresh.version = config.version + 1
+        config = fresh
+        logger.info("Настройки загружены, версия %s", config.version)
+
+    def write(self, new):
+        global config
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(new.to_json(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+        config = new
+        st = os.stat(self.path)
+        self.stamp = (st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        with self.locked():
+            if os.path.exists(self.path):
+                self.read()
+            else:
+                self.write(Config(1, ADMINS, OFFICIAL_USERS, DEFAULT_TEXTS))
+
+    def update(self, admins=None, official=None, texts=None, chats=None):
+        """Применяет изменение поверх самой свежей версии файла.
+
+        Значение может быть функцией от свежего config - тогда оно считается
+        под блокировкой и не затирает то, что успел записать другой процесс.
+        """
+        with self.locked():
+            self.read()
+            fields = {"admins": admins, "official": official, "texts": texts, "chats": chats}
+            for name, value in fields.items():
+                if value is None:
+                    fields[name] = getattr(config, name)
+                elif callable(value):
+                    fields[name] = value(config)
+            self.write(Config(config.version + 1, **fields))
+
+    def update_chat(self, chat_id, **changes):
+        """Меняет поля профиля чата; None убирает поле (чат снова берёт общее значение).
+
+        Значение может быть функцией от свежего профиля чата.
+        """
+        def merge(current):
+            profile = dict(current.chats.get(chat_id, {}))
+            for name, value in changes.items():
+                profile[name] = value(profile) if callable(value) else value
+            profile = {k: v for k, v in profile.items() if v is not None}
+            chats = {**current.chats, chat_id: profile}
+            if not profile:
+                del chats[chat_id]
+            return chats
+        
+        self.update(chats=merge)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(CONFIG_POLL)
+            try:
+                self.read()
+            except Exception:
+                logger.exception("Ошибка чтения настроек")
+
+config_store = ConfigStore(CONFIG_PATH)
+
+# ==================== КЛЮЧЕВЫЕ СЛОВА ====================
+DEFAULT_TRIGGERS = {
+    "как купить": "keywords",
+    "как оплатить": "keywords",
+    "как перевести": "keywords",
+}
+
+ZERO_WIDTH = dict.fromkeys(map(ord, "\u00ad\u200b\u200c\u200d\u200e\u200f\u2060\ufeff"))
+
+# Латинские буквы, похожие на кириллицу, приводятся к кириллице
+HOMOGLYPHS = str.maketrans({
+    "a": "а", "b": "в", "c": "с", "e": "е", "h": "н", "k": "к", "m": "м",
+    "o": "о", "p": "р", "t": "т", "x": "х", "y": "у", "ё": "е",
+    "0": "о", "3": "з", "6": "б",
+})
+
+def normalize_text(text):
+    """Приводит текст к виду для поиска: регистр, ё/е, похожие буквы, без пунктуации"""
+    text = unicodedata.normalize("NFKC", text).translate(ZERO_WIDTH).casefold()
+    text = text.translate(HOMOGLYPHS)
+    text = "".join(ch if ch.isalnum() else " " for ch in text)
+    return " ".join(text.split())
+
+class KeywordMatcher:
+    """Автомат Ахо-Корасик: один проход по тексту находит любую из фраз.
+
+    Объект неизменяемый - при изменении списка фраз собирается новый и
+    подменяет старый целиком.
+    """
+
+    __slots__ = ("phrases", "goto", "fail", "out")
+
+    def __init__(self, phrases):
+        self.phrases = dict(phrases)
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [None]
+        for phrase, block in self.phrases.items():
+            self.insert(normalize_text(phrase), block)
+        self.link()
+
+    def insert(self, phrase, block):
+        if not phrase:
+            return
+        state = 0
+        for ch in phrase:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append(None)
+            state = nxt
+        self.out[state] = block
+
+    def link(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                if self.out[nxt] is None:
+                    self.out[nxt] = self.out[self.fail[nxt]]
+
+    def match(self, text):
+        """Блок первой найденной фразы или None (text уже нормализован)"""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+keywords = KeywordMatcher(DEFAULT_TRIGGERS)
+
+def load_triggers():
+    global keywords
+    db = get_db()
+    fresh = db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'triggers'"
+    ).fetchone() is None
+    db.execute("CREATE TABLE IF NOT EXISTS triggers (phrase TEXT PRIMARY KEY, block TEXT)")
+    if fresh:
+        db.executemany("INSERT INTO triggers VALUES (?, ?)", DEFAULT_TRIGGERS.items())
+        db.commit()
+    keywords = KeywordMatcher(db.execute("SELECT phrase, block FROM triggers"))
+
+def set_trigger(phrase, block=None):
+    """Добавляет (block задан) или удаляет фразу и пересобирает автомат"""
+    global keywords
+    phrases = dict(keywords.phrases)
+    db = get_db()
+    if block is None:
+        phrases.pop(phrase, None)
+        db.execute("DELETE FROM triggers WHERE phrase = ?", (phrase,))
+    else:
+        phrases[phrase] = block
+        db.execute("INSERT OR REPLACE INTO triggers VALUES (?, ?)", (phrase, block))
+    db.commit()
+    keywords = KeywordMatcher(phrases)
+
+# ==================== ПРАВИЛА ЧАТОВ ====================
+# Профиль чата в config.json ("chats" -> id чата) переопределяет только нужное:
+#   "texts": {"welcome": "..."}          - свои тексты поверх общих
+#   "triggers": {"фраза": "блок" | null} - свои триггеры, null убирает общий
+#   "delete_after": 60                   - через сколько секунд удалять ответы бота
+#   "welcome": false                     - не приветствовать новичков
+#   "buttons": false                     - приветствие без кнопок меню
+
+class ChatRules:
+    """Скомпилированные правила одного чата: общий профиль + переопределения чата"""
+
+    __slots__ = ("texts", "keywords", "delete_after", "welcome", "welcome_markup")
+
+    def __init__(self, profile):
+        self.texts = {**config.texts, **profile.get("texts", {})}
+        triggers = profile.get("triggers")
+        if triggers:
+            phrases = {**keywords.phrases, **triggers}
+            self.keywords = KeywordMatcher((p, b) for p, b in phrases.items() if b)
+        else:
+            self.keywords = keywords
+        self.delete_after = profile.get("delete_after", DELETE_AFTER)
+        self.welcome = profile.get("welcome", True)
+        self.welcome_markup = MAIN_BUTTONS if profile.get("buttons", True) else None
+
+class ChatRulesCache:
+    """chat_id -> ChatRules.
+
+    С новой версией config пересобираются только чаты, чей профиль изменился;
+    смена общих текстов или триггеров сбрасывает все.
+    """
+
+    def __init__(self):
+        self.rules = {}
+        self.version = None
+        self.texts = None
+        self.chats = {}
+        self.keywords = None
+        self.default = None
+
+    def sync(self):
+        if config.texts != self.texts or keywords is not self.keywords:
+            self.rules.clear()
+            self.default = ChatRules({})
+        else:
+            for chat_id in list(self.rules):
+                if config.chats.get(chat_id) != self.chats.get(chat_id):
+                    del self.rules[chat_id]
+        self.version = config.version
+        self.texts = config.texts
+        self.chats = config.chats
+        self.keywords = keywords
+
+    def get(self, chat_id):
+        if self.version != config.version or self.keywords is not keywords:
+            self.sync()
+        rules = self.rules.get(chat_id)
+        if rules is None:
+            profile = config.chats.get(chat_id)
+            rules = self.rules[chat_id] = ChatRules(profile) if profile else self.default
+        return rules
+
+chat_rules = ChatRulesCache()
+
+# ==================== ПРОВЕРКА АККАУНТОВ ====================
+LOOKALIKE_DISTANCE = 2  # максимум правок, при котором ник считается подделкой
+
+# Символы, которые в нике выглядят одинаково (по мотивам Unicode confusables)
+CONFUSABLES = str.maketrans({
+    "а": "a", "в": "b", "с": "c", "е": "e", "ё": "e", "һ": "h", "і": "l", "ј": "j",
+    "к": "k", "м": "m", "н": "h", "о": "o", "р": "p", "т": "t", "у": "y", "х": "x",
+    "ѕ": "s", "ԁ": "d", "ɡ": "g", "ո": "n", "ս": "u", "ԛ": "q", "ԝ": "w",
+    "i": "l", "1": "l", "|": "l", "!": "l", "0": "o", "5": "s", "3": "e", "8": "b",
+    "-": "_",
+})
+
+def username_key(username):
+    """Канонический ключ: Telegram не различает регистр в никах"""
+    return username.strip().lstrip("@").casefold()
+
+def username_skeleton(username):
+    """Скелет ника: похожие символы сведены к одному, rn/vv/cl склеены"""
+    text = unicodedata.normalize("NFKC", username_key(username)).translate(ZERO_WIDTH)
+    text = text.casefold().translate(CONFUSABLES)
+    return text.replace("rn", "m").replace("vv", "w").replace("cl", "d").replace("__", "_")
+
+def edit_distance(a, b, limit):
+    """Расстояние Левенштейна; если оно больше limit, возвращает limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    prev = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        cur = [i]
+        for j, cb in enumerate(b, 1):
+            cur.append(min(prev[j] + 1, cur[j - 1] + 1, prev[j - 1] + (ca != cb)))
+        if min(cur) > limit:
+            return limit + 1
+        prev = cur
+    return prev[-1]
+
+class BKTree:
+    """BK-дерево по расстоянию Левенштейна для поиска близких ников"""
+
+    __slots__ = ("root",)
+
+    def __init__(self, words=()):
+        self.root = None
+        for word, value in words:
+            self.add(word, value)
+
+    def add(self, word, value):
+        node = [word, value, {}]
+        if self.root is None:
+            self.root = node
+            return
+        cur = self.root
+        while True:
+            d = edit_distance(word, cur[0], len(word) + len(cur[0]))
+            if d == 0:
+                return
+            child = cur[2].get(d)
+            if child is None:
+                cur[2][d] = node
+                return
+            cur = child
+
+    def nearest(self, word, limit):
+        """(расстояние, значение) ближайшего слова не дальше limit или None"""
+        best = None
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            # дальше limit + max(ребро) точное расстояние уже не нужно
+            d = edit_distance(word, node[0], limit + max(node[2], default=0))
+            if d <= limit and (best is None or d < best[0]):
+                best = (d, node[1])
+            for dist, child in node[2].items():
+                if d - limit <= dist <= d + limit:
+                    stack.append(child)
+        return best
+
+class OfficialIndex:
+    """Индекс официальных аккаунтов: точный ключ, скелет и BK-дерево.
+
+    Пересобирается сам, как только в config появляется новый список.
+    """
+
+    def __init__(self):
+        self.source = None
+        self.by_key = {}
+        self.by_skeleton = {}
+        self.tree = BKTree()
+
+    def build(self, users):
+        self.source = users
+        self.by_key = {username_key(u): u for u in users}
+        self.by_skeleton = {username_skeleton(u): u for u in users}
+        self.tree = BKTree(self.by_skeleton.items())
+
+    def check(self, username):
+        """("official", ник), ("impersonating", ник, расстояние) или ("unknown",)"""
+        if self.source is not config.official:
+            self.build(config.official)
+        
+        key = username_key(username)
+        official = self.by_key.get(key)
+        if official:
+            return ("official", official)
+        
+        skeleton = username_skeleton(username)
+        official = self.by_skeleton.get(skeleton)
+        if official:
+            distance = edit_distance(key, username_key(official), len(key) + len(official))
+            return ("impersonating", official, distance)
+        
+        found = self.tree.nearest(skeleton, LOOKALIKE_DISTANCE)
+        if found:
+            return ("impersonating", found[1], found[0])
+        return ("unknown",)
+
+official_index = OfficialIndex()
+
+# ==================== ИНДЕКС ПОЛЬЗОВАТЕЛЕЙ ====================
+USER_CACHE_SIZE = 50000  # сколько пользователей держать в памяти
+USER_FLUSH = 5  # как часто (в секундах) изменения пишутся в SQLite
+
+class UserIndex:
+    """Индекс username -> user_id по всем апдейтам, которые видит бот.
+
+    В памяти - ограниченный LRU, на диске - SQLite с записью пачками.
+    """
+
+    def __init__(self):
+        self.by_id = OrderedDict()  # user_id -> (username_key, chat_id, seen)
+        self.by_name = {}
+        self.dirty = {}
+        self.task = None
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def load(self):
+        db = get_db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "user_id INTEGER PRIMARY KEY, username TEXT, chat_id INTEGER, seen REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS users_username ON users (username)")
+        rows = db.execute(
+            "SELECT user_id, username, chat_id, seen FROM users ORDER BY seen DESC LIMIT ?",
+            (USER_CACHE_SIZE,)
+        ).fetchall()
+        for user_id, username, chat_id, seen in reversed(rows):
+            self.put(user_id, username, chat_id, seen)
+
+    def put(self, user_id, username, chat_id, seen):
+        old = self.by_id.pop(user_id, None)
+        if old and old[0] and old[0] != username and self.by_name.get(old[0]) == user_id:
+            del self.by_name[old[0]]
+        self.by_id[user_id] = (username, chat_id, seen)
+        if username:
+            self.by_name[username] = user_id
+        while len(self.by_id) > USER_CACHE_SIZE:
+            evicted, (name, _, _) = self.by_id.popitem(last=False)
+            if name and self.by_name.get(name) == evicted:
+                del self.by_name[name]
+
+    def remember(self, user, chat_id):
+        if user is None or user.is_bot:
+            return
+        username = username_key(user.username) if user.username else None
+        known = self.by_id.get(user.id)
+        now = time.time()
+        if known and known[0] == username and known[1] == chat_id and now - known[2] < USER_FLUSH:
+            self.by_id.move_to_end(user.id)
+            return
+        self.put(user.id, username, chat_id, now)
+        self.dirty[user.id] = (user.id, username, chat_id, now)
+
+    def resolve(self, username):
+        """user_id по нику (с @ или без) или None"""
+        key = username_key(username)
+        user_id = self.by_name.get(key)
+        if user_id is not None:
+            self.by_id.move_to_end(user_id)
+            return user_id
+        row = get_db().execute(
+            "SELECT user_id, chat_id, seen FROM users WHERE username = ? ORDER BY seen DESC LIMIT 1",
+            (key,)
+        ).fetchone()
+        if row is None or row[0] in self.by_id:
+            # в памяти у этого id уже другой ник - запись в базе устарела
+            return None
+        self.put(row[0], key, row[1], row[2])
+        return row[0]
+
+    def save(self):
+        if not self.dirty:
+            return
+        db = get_db()
+        rows = list(self.dirty.values())
+        self.dirty.clear()
+        # ник мог перейти к другому человеку - у прежнего владельца он стирается
+        db.executemany(
+            "UPDATE users SET username = NULL WHERE username = ? AND user_id != ?",
+            [(r[1], r[0]) for r in rows if r[1]]
+        )
+        db.executemany(
+            "INSERT OR REPLACE INTO users (user_id, username, chat_id, seen) VALUES (?, ?, ?, ?)",
+            rows
         )
+        db.commit()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(USER_FLUSH)
+            try:
+                self.save()
+            except Exception:
+                logger.exception("Ошибка записи индекса пользователей")
+
+users = UserIndex()
+
+def resolve_user_arg(arg):
+    """user_id из аргумента команды: число или @username из индекса"""
+    arg = arg.strip()
+    if arg.startswith("@"):
+        user_id = users.resolve(arg)
+        if user_id is None:
+            raise ValueError(f"пользователь {arg} ещё не встречался боту")
+        return user_id
+    return int(arg)
+
+async def track_users(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Пополняет индекс пользователей из любого апдейта"""
+    chat_id = update.effective_chat.id if update.effective_chat else None
+    users.remember(update.effective_user, chat_id)
+    msg = update.message
+    if msg:
+        history.add(msg)
+        for user in msg.new_chat_members or ():
+            users.remember(user, chat_id)
+        if msg.reply_to_message:
+            users.remember(msg.reply_to_message.from_user, chat_id)
+
+# ==================== ИСТОРИЯ СООБЩЕНИЙ ====================
+HISTORY_SIZE = 500  # сколько последних сообщений помнить в каждом чате
+
+class MessageHistory:
+    """Кольцевой буфер последних сообщений чата: (message_id, user_id, ответ_на)"""
+
+    def __init__(self):
+        self.chats = {}
+
+    def add(self, msg):
+        if not msg.from_user:
+            return
+        ring = self.chats.get(msg.chat_id)
+        if ring is None:
+            ring = self.chats[msg.chat_id] = deque(maxlen=HISTORY_SIZE)
+        reply_to = msg.reply_to_message.message_id if msg.reply_to_message else None
+        ring.append((msg.message_id, msg.from_user.id, reply_to))
+
+    def by_user(self, chat_id, user_id, limit):
+        """id последних limit сообщений пользователя в чате"""
+        found = []
+        for message_id, author, _ in reversed(self.chats.get(chat_id, ())):
+            if author == user_id:
+                found.append(message_id)
+                if len(found) >= limit:
+                    break
+        return found
+
+    def thread(self, chat_id, root):
+        """Ветка ответов от root вниз: сам root и все ответы на ветку.
+
+        Предков не берём, чтобы не задеть автора исходного сообщения.
+        Возвращает {message_id: user_id}.
+        """
+        ring = self.chats.get(chat_id, ())
+        authors = {m: u for m, u, _ in ring}
+        thread = {root}
+        for message_id, _, reply_to in ring:
+            if reply_to in thread:
+                thread.add(message_id)
+        return {m: authors[m] for m in thread if m in authors}
+
+history = MessageHistory()
+
+# ==================== ЖУРНАЛ МОДЕРАЦИИ ====================
+AUDIT_DIR = os.getenv("BOT_AUDIT_DIR", "audit")
+AUDIT_CURRENT = "current.jsonl"  # файл, в который идёт запись сейчас
+AUDIT_MAX_BYTES = 10 << 20  # после стольких байт файл ротируется...
+AUDIT_BLOCK = 64 << 10  # ...а внутри делится на блоки примерно такого размера
+AUDIT_QUEUE = 10000  # записей в очереди больше этого не ждёт (лишние теряются)
+AUDIT_BATCH = 1000  # записей за один fsync
+AUDIT_FLUSH_INTERVAL = 1  # не чаще одного fsync в столько секунд
+AUDIT_DEFAULT_LIMIT = 50
+AUDIT_MAX_LIMIT = 200  # числа больше этого в /audit считаются ID пользователя
+
+class AuditLog:
+    """Журнал действий модерации: JSON-строки в файлах, запись в фоне.
+
+    Обработчики только кладут запись в ограниченную очередь. Фоновая задача
+    пишет пачками с одним fsync на пачку, ротирует файл по размеру или смене
+    дня и сжимает старый в .gz. Файл делится на блоки по AUDIT_BLOCK байт,
+    в архиве каждый блок - отдельный gzip-member. В SQLite хранится маленький
+    индекс: в каких блоках каких файлов есть чат/пользователь/действие, так
+    что /audit читает с конца только нужные блоки и останавливается на limit.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.queue = asyncio.Queue(AUDIT_QUEUE)
+        self.day = None
+        self.size = 0  # байт в текущем файле
+        self.blocks = [0]  # смещения начал блоков текущего файла
+        self.dropped = 0
+        self.task = None
+
+    def load(self):
+        os.makedirs(self.path, exist_ok=True)
+        db = get_db()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS audit_files ("
+            "name TEXT PRIMARY KEY, first_ts INTEGER, last_ts INTEGER, count INTEGER)"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS audit_blocks ("
+            "key TEXT, name TEXT, block INTEGER, PRIMARY KEY (key, name, block)) WITHOUT ROWID"
+        )
+        db.commit()
+        row = db.execute("SELECT first_ts FROM audit_files WHERE name = ?", (AUDIT_CURRENT,)).fetchone()
+        if row:
+            self.day = time.strftime("%Y%m%d", time.localtime(row[0]))
+        current = os.path.join(self.path, AUDIT_CURRENT)
+        if os.path.exists(current):
+            self.size = os.path.getsize(current)
+            rows = db.execute(
+                "SELECT DISTINCT block FROM audit_blocks WHERE name = ? ORDER BY block", (AUDIT_CURRENT,)
+            )
+            self.blocks = [block for block, in rows] or [0]
+
+    def add(self, action, chat_id, admin_id, target=None, reason=None, result="ok"):
+        """Запись в журнал; admin_id 0 - действие самого бота"""
+        record = {
+            "ts": int(time.time()),
+            "action": action,
+            "chat": chat_id,
+            "admin": admin_id,
+            "target": target,
+            "reason": reason,
+            "result": result,
+        }
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Журнал модерации переполнен, запись потеряна: %s", record)
+
+    def log(self, update, action, target=None, reason=None, error=None):
+        """Запись о действии, сделанном командой из update"""
+        self.add(
+            action,
+            update.effective_chat.id,
+            update.effective_user.id,
+            target,
+            reason,
+            "ok" if error is None else f"ошибка: {error}"
+        )
+
+    def write(self, batch):
+        """Дописывает пачку (в потоке).
+
+        Возвращает блок каждой записи и ротацию: (имя архива, {смещение
+        блока в файле: смещение в архиве}) или None.
+        """
+        current = os.path.join(self.path, AUDIT_CURRENT)
+        today = time.strftime("%Y%m%d")
+        rotated = None
+        if os.path.exists(current) and (os.path.getsize(current) >= AUDIT_MAX_BYTES or self.day != today):
+            rotated = self.rotate(current)
+        self.day = today
+        lines = [(json.dumps(r, ensure_ascii=False) + "\n").encode("utf-8") for r in batch]
+        placed = []
+        for line in lines:
+            # новый блок начинается только с целой строки
+            if self.size - self.blocks[-1] >= AUDIT_BLOCK:
+                self.blocks.append(self.size)
+            placed.append(self.blocks[-1])
+            self.size += len(line)
+        with open(current, "ab") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        return placed, rotated
+
+    def rotate(self, current):
+        """Сжимает текущий файл поблочно в архив и начинает новый"""
+        stamp = f"audit-{self.day or time.strftime('%Y%m%d')}-{time.strftime('%H%M%S')}"
+        name = f"{stamp}.jsonl.gz"
+        n = 1
+        while os.path.exists(os.path.join(self.path, name)):
+            n += 1
+            name = f"{stamp}-{n}.jsonl.gz"
+        with open(current, "rb") as src:
+            data = src.read()
+        moved = {}
+        with open(os.path.join(self.path, name), "wb") as dst:
+            for start, end in zip(self.blocks, self.blocks[1:] + [len(data)]):
+                if start < end:
+                    moved[start] = dst.tell()
+                    dst.write(gzip.compress(data[start:end], mtime=0))
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.remove(current)
+        self.size = 0
+        self.blocks = [0]
+        return name, moved
+
+    def index(self, batch, placed, rotated):
+        db = get_db()
+        if rotated:
+            name, moved = rotated
+            db.execute("UPDATE audit_files SET name = ? WHERE name = ?", (name, AUDIT_CURRENT))
+            db.executemany(
+                "UPDATE audit_blocks SET name = ?, block = ? WHERE name = ? AND block = ?",
+                [(name, new, AUDIT_CURRENT, old) for old, new in moved.items()]
+            )
+            db.execute("DELETE FROM audit_blocks WHERE name = ?", (AUDIT_CURRENT,))
+        db.execute(
+            "INSERT INTO audit_files (name, first_ts, last_ts, count) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET last_ts = excluded.last_ts, count = count + excluded.count",
+            (AUDIT_CURRENT, batch[0]["ts"], batch[-1]["ts"], len(batch))
+        )
+        keys = set()
+        for r, block in zip(batch, placed):
+            keys.update((key, block) for key in audit_keys(r))
+        db.executemany(
+            "INSERT OR IGNORE INTO audit_blocks (key, name, block) VALUES (?, ?, ?)",
+            [(key, AUDIT_CURRENT, block) for key, block in keys]
+        )
+        db.commit()
+
+    def take(self, first=None):
+        batch = [first] if first else []
+        while len(batch) < AUDIT_BATCH and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        return batch
+
+    async def run(self):
+        while True:
+            batch = self.take(await self.queue.get())
+            try:
+                placed, rotated = await asyncio.to_thread(self.write, batch)
+                self.index(batch, placed, rotated)
+            except (OSError, sqlite3.Error) as e:
+                logger.warning("Не удалось записать журнал модерации: %s", e)
+            await asyncio.sleep(AUDIT_FLUSH_INTERVAL)
+
+    def save(self):
+        while not self.queue.empty():
+            batch = self.take()
+            self.index(batch, *self.write(batch))
+
+    async def query(self, limit, chat_id=None, target=None, action=None):
+        """Последние limit записей по условиям, новые первыми"""
+        wanted = audit_keys({"chat": chat_id, "target": target, "action": action})
+        where, having, params = "", "", ()
+        if wanted:
+            where = f"WHERE b.key IN ({', '.join('?' * len(wanted))}) "
+            having = "HAVING COUNT(*) = ? "
+            params = (*wanted, len(wanted))
+        sql = (
+            "SELECT b.name, b.block FROM audit_blocks b JOIN audit_files f ON f.name = b.name "
+            f"{where}GROUP BY b.name, b.block {having}"
+            "ORDER BY MAX(f.last_ts) DESC, MAX(f.rowid) DESC, b.block DESC"
+        )
+        blocks = get_db().execute(sql, params).fetchall()
+        return await asyncio.to_thread(self.scan, blocks, limit, wanted)
+
+    def scan(self, blocks, limit, wanted):
+        """Читает блоки по порядку, пока не наберётся limit записей"""
+        found = []
+        for name, block in blocks:
+            try:
+                lines = self.read_block(name, block)
+            except (OSError, zlib.error):
+                continue
+            for line in reversed(lines):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # строка, которую писатель ещё не дописал
+                if wanted <= audit_keys(record):
+                    found.append(record)
+                    if len(found) >= limit:
+                        return found
+        return found
+
+    def read_block(self, name, start):
+        """Строки одного блока файла журнала"""
+        with open(os.path.join(self.path, name), "rb") as f:
+            f.seek(start)
+            if name.endswith(".gz"):
+                # в архиве блок - отдельный gzip-member с этого смещения
+                unpack = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                parts = []
+                while not unpack.eof:
+                    chunk = f.read(AUDIT_BLOCK)
+                    if not chunk:
+                        break
+                    parts.append(unpack.decompress(chunk))
+                data = b"".join(parts)
+            else:
+                # в текущем файле блок - строки, начатые в пределах AUDIT_BLOCK
+                data = f.read(AUDIT_BLOCK)
+                if len(data) == AUDIT_BLOCK and not data.endswith(b"\n"):
+                    data += f.readline()
+        return data.decode("utf-8", "replace").splitlines()
+
+def audit_keys(record):
+    """Ключи индекса записи: чат, цель, действие"""
+    keys = set()
+    if record.get("chat") is not None:
+        keys.add(f"c{record['chat']}")
+    if record.get("target") is not None:
+        keys.add(f"u{record['target']}")
+    if record.get("action"):
+        keys.add(f"x{record['action']}")
+    return keys
+
+audit = AuditLog(AUDIT_DIR)
+
+# ==================== АДМИНЫ ЧАТОВ ====================
+CHAT_ADMINS_TTL = 600  # сколько секунд верить списку админов чата
+CHAT_ADMINS_RETRY = 5  # через сколько секунд повторить запрос после ошибки
+
+class ChatAdminCache:
+    """Кэш getChatAdministrators по чатам.
+
+    Живёт CHAT_ADMINS_TTL, но правится сразу по апдейтам chat_member /
+    my_chat_member. Одновременные запросы по одному чату сливаются в один.
+    """
+
+    def __init__(self):
+        self.chats = {}  # chat_id -> (истекает, {user_id: статус})
+        self.inflight = {}
+
+    async def fetch(self, bot, chat_id):
+        try:
+            members = await bot.get_chat_administrators(chat_id)
+        except TelegramError as e:
+            # Ошибку помним недолго, а прежний список (если был) считаем ещё верным
+            logger.warning("Не удалось получить админов %s: %s", chat_id, e)
+            old = self.chats.get(chat_id)
+            admins = old[1] if old else {}
+            self.chats[chat_id] = (time.monotonic() + CHAT_ADMINS_RETRY, admins)
+            return admins
+        admins = {m.user.id: m.status for m in members}
+        self.chats[chat_id] = (time.monotonic() + CHAT_ADMINS_TTL, admins)
+        return admins
+
+    async def get(self, bot, chat_id):
+        """{user_id: статус} админов чата"""
+        cached = self.chats.get(chat_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        task = self.inflight.get(chat_id)
+        if task is None:
+            task = self.inflight[chat_id] = asyncio.ensure_future(self.fetch(bot, chat_id))
+            task.add_done_callback(lambda _: self.inflight.pop(chat_id, None))
+        return await asyncio.shield(task)
+
+    async def status(self, bot, chat, user_id):
+        """"creator", "administrator" или None"""
+        if chat.type == "private":
+            return None
+        return (await self.get(bot, chat.id)).get(user_id)
+
+    def apply(self, chat_id, member):
+        """Обновляет кэш по новому статусу участника"""
+        cached = self.chats.get(chat_id)
+        if not cached:
+            return
+        if member.status in ("creator", "administrator"):
+            cached[1][member.user.id] = member.status
+        else:
+            cached[1].pop(member.user.id, None)
+
+chat_admins = ChatAdminCache()
+
+async def can_moderate(update, context):
+    """Админ бота, создатель или админ этого чата"""
+    user = update.effective_user
+    if is_admin(user.id):
+        return True
+    return await chat_admins.status(context.bot, update.effective_chat, user.id) is not None
+
+async def track_chat_admins(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    change = update.chat_member or update.my_chat_member
+    chat_admins.apply(change.chat.id, change.new_chat_member)
+
+# ==================== АНТИФЛУД ====================
+FLOOD_LIMIT = 8  # сообщений...
+FLOOD_WINDOW = 5  # ...за столько секунд считается флудом
+FLOOD_ACTION = "mute"  # "mute" или "ban"
+FLOOD_MUTE = 600  # на сколько секунд мьютить
+FLOOD_IDLE = 60  # окно пользователя забывается после стольких секунд тишины
+FLOOD_MAX_TRACKED = 100000  # максимум отслеживаемых пар (чат, пользователь)
+
+class FloodWindow:
+    """Кольцевой буфер последних FLOOD_LIMIT сообщений пользователя в чате"""
+
+    __slots__ = ("stamps", "ids", "pos", "last")
+
+    def __init__(self):
+        self.stamps = [0.0] * FLOOD_LIMIT
+        self.ids = [0] * FLOOD_LIMIT
+        self.pos = 0
+        self.last = 0.0
+
+    def hit(self, now, message_id):
+        """Запоминает сообщение; True, если последние FLOOD_LIMIT уложились в FLOOD_WINDOW"""
+        self.stamps[self.pos] = now
+        self.ids[self.pos] = message_id
+        self.pos = (self.pos + 1) % FLOOD_LIMIT
+        self.last = now
+        # после записи на позиции pos лежит самое старое из последних сообщений
+        return now - self.stamps[self.pos] < FLOOD_WINDOW
+
+class FloodGuard:
+    def __init__(self):
+        self.windows = OrderedDict()
+
+    def __len__(self):
+        return len(self.windows)
+
+    def hit(self, chat_id, user_id, message_id):
+        """Учитывает сообщение; при флуде возвращает id последних сообщений, иначе None"""
+        now = time.monotonic()
+        key = (chat_id, user_id)
+        window = self.windows.get(key)
+        if window is None:
+            window = self.windows[key] = FloodWindow()
+        else:
+            self.windows.move_to_end(key)
+        flooded = window.hit(now, message_id)
+        
+        # самые давно молчавшие пары лежат в начале
+        while self.windows:
+            oldest = next(iter(self.windows.values()))
+            if now - oldest.last < FLOOD_IDLE and len(self.windows) <= FLOOD_MAX_TRACKED:
+                break
+            self.windows.popitem(last=False)
+        
+        if not flooded:
+            return None
+        self.windows.pop(key, None)
+        return [i for i in window.ids if i]
+
+flood = FloodGuard()
+
+async def flood_guard(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Стоит перед text_router: мьютит/банит флудеров и удаляет их сообщения"""
+    msg = update.message
+    if not msg or not msg.from_user or is_admin(msg.from_user.id):
+        return
+    
+    ids = flood.hit(msg.chat_id, msg.from_user.id, msg.message_id)
+    if ids is None:
+        return
+    
+    user = msg.from_user
+    chat = update.effective_chat
+    if await chat_admins.status(context.bot, chat, user.id):
+        return
+    try:
+        if FLOOD_ACTION == "ban":
+            await chat.ban_member(user.id)
+            stats.hit("bans_issued", chat.id)
+            action = "забанен"
+        else:
+            await chat.restrict_member(
+                user.id,
+                ChatPermissions(can_send_messages=False),
+                until_date=int(time.time()) + FLOOD_MUTE
+            )
+            action = f"замьючен на {FLOOD_MUTE // 60} мин"
+        await context.bot.delete_messages(chat.id, ids)
+    except TelegramError as e:
+        logger.warning("Антифлуд в %s не сработал: %s", chat.id, e)
+        audit.add(FLOOD_ACTION, chat.id, 0, user.id, "флуд", f"ошибка: {e}")
+        raise ApplicationHandlerStop
+    
+    audit.add(FLOOD_ACTION, chat.id, 0, user.id, f"флуд, удалено {len(ids)} сообщений")
+    logger.info("Флуд: %s (%s) в %s, удалено %s сообщений", user.id, action, chat.id, len(ids))
+    sender.send(
+        chat.id,
+        f"🚫 Пользователь {user.full_name} (ID: {user.id}) {action} за флуд.",
+        priority=PRIO_ADMIN,
+        autodelete=True
+    )
+    raise ApplicationHandlerStop
+
+# ==================== ПОВТОРЯЮЩИЕСЯ РАССЫЛКИ ====================
+SPAM_MIN_LEN = 30  # короче этого (после нормализации) сообщения не проверяются
+SPAM_MAX_LEN = 300  # длиннее - берётся только начало
+SPAM_DISTANCE = 5  # максимум отличающихся бит SimHash у «того же» текста
+SPAM_USERS = 3  # столько разных авторов...
+SPAM_CHATS = 3  # ...или столько разных чатов...
+SPAM_MESSAGES = 5  # ...и столько сообщений вместе делают текст рассылкой
+SPAM_WINDOW = 600  # сколько секунд помнить отпечатки
+SPAM_MAX_ENTRIES = 20000  # жёсткий предел числа отпечатков
+SPAM_BANDS = 6  # полос LSH, должно быть больше SPAM_DISTANCE
+SPAM_KEEP_IDS = 20  # сколько сообщений рассылки помнить для удаления
+
+def simhash(text):
+    """64-битный SimHash по символьным 4-граммам"""
+    text = text[:SPAM_MAX_LEN]
+    hashes = {hash(text[i:i + 4]) & 0xFFFFFFFFFFFFFFFF for i in range(len(text) - 3)}
+    half = len(hashes) / 2
+    fp = 0
+    # столбцы битов считаются через zip по двоичным строкам - так в разы быстрее цикла по битам
+    for bit, column in enumerate(zip(*(format(h, "064b") for h in hashes))):
+        if column.count("1") > half:
+            fp |= 1 << (63 - bit)
+    return fp
+
+class SpamCluster:
+    __slots__ = ("fp", "users", "chats", "count", "messages", "last", "flagged")
+
+    def __init__(self, fp, now):
+        self.fp = fp
+        self.users = set()
+        self.chats = set()
+        self.count = 0
+        self.messages = deque(maxlen=SPAM_KEEP_IDS)
+        self.last = now
+        self.flagged = False
+
+class SpamIndex:
+    """LSH-индекс отпечатков недавних сообщений.
+
+    Отпечатки с расстоянием Хэмминга <= SPAM_DISTANCE обязательно совпадают
+    хотя бы в одной из SPAM_BANDS полос, поэтому поиск - это несколько
+    обращений к словарю.
+    """
+
+    def __init__(self):
+        self.clusters = OrderedDict()  # id -> SpamCluster, давно не встречавшиеся в начале
+        self.bands = {}  # (полоса, значение) -> set(id)
+        self.next_id = 0
+
+    def __len__(self):
+        return len(self.clusters)
+
+    def band_keys(self, fp):
+        width = 64 // SPAM_BANDS
+        mask = (1 << width) - 1
+        return [(b, fp >> (b * width) & mask) for b in range(SPAM_BANDS)]
+
+    def evict(self, now):
+        while self.clusters:
+            cid, cluster = next(iter(self.clusters.items()))
+            if now - cluster.last < SPAM_WINDOW and len(self.clusters) <= SPAM_MAX_ENTRIES:
+                break
+            del self.clusters[cid]
+            for key in self.band_keys(cluster.fp):
+                bucket = self.bands.get(key)
+                if bucket:
+                    bucket.discard(cid)
+                    if not bucket:
+                        del self.bands[key]
+
+    def check(self, text, chat_id, user_id, message_id):
+        """Учитывает сообщение (text нормализован).
+
+        Возвращает None или список (chat_id, message_id) рассылки, которые надо удалить.
+        """
+        if len(text) < SPAM_MIN_LEN:
+            return None
+        now = time.monotonic()
+        self.evict(now)
+        fp = simhash(text)
+        keys = self.band_keys(fp)
+        
+        cluster = None
+        for key in keys:
+            for cid in self.bands.get(key, ()):
+                other = self.clusters[cid]
+                if bin(other.fp ^ fp).count("1") <= SPAM_DISTANCE:
+                    cluster = other
+                    self.clusters.move_to_end(cid)
+                    break
+            if cluster:
+                break
+        
+        if cluster is None:
+            cid = self.next_id
+            self.next_id += 1
+            cluster = self.clusters[cid] = SpamCluster(fp, now)
+            for key in keys:
+                self.bands.setdefault(key, set()).add(cid)
+        
+        cluster.last = now
+        cluster.users.add(user_id)
+        cluster.chats.add(chat_id)
+        cluster.count += 1
+        cluster.messages.append((chat_id, message_id))
+        if cluster.flagged:
+            return [(chat_id, message_id)]
+        # Одинаковый вопрос от пары человек - не рассылка; нужен охват (авторы
+        # или чаты - один аккаунт по многим нашим чатам) и объём
+        spread = len(cluster.users) >= SPAM_USERS or len(cluster.chats) >= SPAM_CHATS
+        if spread and cluster.count >= SPAM_MESSAGES:
+            cluster.flagged = True
+            found = list(cluster.messages)
+            cluster.messages.clear()
+            return found
+        return None
+
+spam = SpamIndex()
+
+async def delete_spam(bot, messages):
+    """Удаляет сообщения рассылки пачками по чатам"""
+    by_chat = {}
+    for chat_id, message_id in messages:
+        by_chat.setdefault(chat_id, []).append(message_id)
+    for chat_id, ids in by_chat.items():
+        await bulk_delete(bot, chat_id, ids)
+
+# ==================== ПРИВЕТСТВИЯ ====================
+WELCOME_WINDOW = 3  # входы за столько секунд объединяются в одно приветствие
+WELCOME_MAX_NAMES = 10  # сколько имён перечислять, остальные - «и ещё N»
+RAID_MODE = True  # включить защиту от рейдов
+RAID_JOINS = 15  # столько входов...
+RAID_WINDOW = 10  # ...за столько секунд включают режим рейда
+RAID_COOLDOWN = 120  # режим рейда снимается после стольких секунд без входов
+RAID_MUTE = 3600  # на сколько секунд новички ограничиваются во время рейда
+
+class WelcomeBatcher:
+    """Собирает входы в чат за WELCOME_WINDOW в одно приветствие.
+
+    Новое приветствие заменяет предыдущее, которое ещё не удалено.
+    """
+
+    def __init__(self):
+        self.pending = {}  # chat_id -> [имена]
+        self.last = {}  # chat_id -> (message_id, время) последнего приветствия
+        self.joins = {}  # chat_id -> deque времён входа
+        self.raid_until = {}
+        self.tasks = set()  # ждущие окна flush_later; ссылка держит задачу живой
+
+    def is_raid(self, chat_id, count):
+        """Учитывает count входов; True, если в чате сейчас рейд"""
+        if not RAID_MODE:
+            return False
+        now = time.monotonic()
+        joins = self.joins.get(chat_id)
+        if joins is None:
+            joins = self.joins[chat_id] = deque(maxlen=RAID_JOINS)
+        joins.extend([now] * count)
+        if len(joins) == RAID_JOINS and now - joins[0] < RAID_WINDOW:
+            if self.raid_until.get(chat_id, 0) < now:
+                logger.warning("Рейд в чате %s: приветствия отключены", chat_id)
+            self.raid_until[chat_id] = now + RAID_COOLDOWN
+        return self.raid_until.get(chat_id, 0) > now
+
+    def add(self, chat_id, names):
+        pending = self.pending.get(chat_id)
+        if pending is None:
+            self.pending[chat_id] = list(names)
+            task = asyncio.create_task(self.flush_later(chat_id))
+            self.tasks.add(task)
+            task.add_done_callback(functools.partial(self.finished, chat_id))
+        else:
+            pending.extend(names)
+
+    def finished(self, chat_id, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning("Приветствие в %s не отправлено: %s", chat_id, task.exception())
+
+    async def stop(self):
+        """При остановке бота: не ждать окна, отправить накопленное сразу"""
+        for task in list(self.tasks):
+            task.cancel()
+        chats = list(self.pending)
+        flushes = asyncio.gather(*(self.flush(chat_id) for chat_id in chats), return_exceptions=True)
+        try:
+            results = await asyncio.wait_for(flushes, SEND_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            # сообщения остаются в очереди отправки, их дождётся sender.drain
+            return
+        for chat_id, result in zip(chats, results):
+            if isinstance(result, Exception):
+                logger.warning("Приветствие в %s не отправлено: %s", chat_id, result)
+
+    async def flush_later(self, chat_id):
+        await asyncio.sleep(WELCOME_WINDOW)
+        await self.flush(chat_id)
+
+    async def flush(self, chat_id):
+        names = self.pending.pop(chat_id, [])
+        if not names:
+            return
+        
+        shown = ", ".join(names[:WELCOME_MAX_NAMES])
+        if len(names) > WELCOME_MAX_NAMES:
+            shown += f" и ещё {len(names) - WELCOME_MAX_NAMES}"
+        
+        rules = chat_rules.get(chat_id)
+        old = self.last.pop(chat_id, None)
+        if old and time.monotonic() - old[1] < rules.delete_after:
+            try:
+                await sender.bot.delete_messages(chat_id, [old[0]])
+            except TelegramError as e:
+                logger.debug("Старое приветствие в %s не удалено: %s", chat_id, e)
+        
+        stats.hit("welcome_messages", chat_id)
         # Приветственное сообщение удаляется через время
-        asyncio.create_task(delete_later(msg))
+        msg = await sender.send(
+            chat_id,
+            render_welcome(rules.texts["welcome"], shown),
+            priority=PRIO_LOW,
+            autodelete=True,
+            reply_markup=rules.welcome_markup
+        )
+        if msg:
+            self.last[chat_id] = (msg.message_id, time.monotonic())
+
+welcomes = WelcomeBatcher()
+
+async def welcome_new_member(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    chat = update.effective_chat
+    members = update.message.new_chat_members
+    
+    if welcomes.is_raid(chat.id, len(members)):
+        # Во время рейда бот молчит и ограничивает новичков
+        for user in members:
+            if user.is_bot:
+                continue
+            try:
+                await chat.restrict_member(
+                    user.id,
+                    ChatPermissions(can_send_messages=False),
+                    until_date=int(time.time()) + RAID_MUTE
+                )
+                audit.add("mute", chat.id, 0, user.id, "рейд")
+            except TelegramError as e:
+                logger.warning("Не удалось ограничить %s в %s: %s", user.id, chat.id, e)
+                audit.add("mute", chat.id, 0, user.id, "рейд", f"ошибка: {e}")
+        return
+    
+    if chat_rules.get(chat.id).welcome:
+        welcomes.add(chat.id, [user.first_name or "клиент" for user in members])
 
 async def check_username(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Проверка юзернейма - сообщение НЕ удаляется"""
     text = update.message.text.strip()
-    STATS["checks_performed"] += 1
+    stats.hit("checks_performed", update.effective_chat.id)
     
-    if text in OFFICIAL_USERS:
+    result = official_index.check(text)
+    if result[0] == "official":
         # ✅ Официальный аккаунт - сообщение остается навсегда
-        await update.message.reply_text("✅ Вы общаетесь с официальным аккаунтом.")
+        sender.reply(update.message, "✅ Вы общаетесь с официальным аккаунтом.")
+    elif result[0] == "impersonating":
+        # ⚠️ Подделка под официальный аккаунт - сообщение остается навсегда
+        sender.reply(
+            update.message,
+            f"‼⚠ ВНИМАНИЕ! ЭТО МОШЕННИК! ⚠‼\n"
+            f"Аккаунт маскируется под {result[1]} (отличий: {result[2]})"
+        )
     else:
         # ⚠️ Мошенник - сообщение остается навсегда
-        await update.message.reply_text("‼⚠ ВНИМАНИЕ! ЭТО МОШЕННИК! ⚠‼")
+        sender.reply(update.message, "‼⚠ ВНИМАНИЕ! ЭТО МОШЕННИК! ⚠‼")
 
 async def check_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /check - результат удаляется, а само сообщение проверки остается"""
-    STATS["checks_performed"] += 1
+    stats.hit("checks_performed", update.effective_chat.id)
     if not context.args:
-        msg = await update.message.reply_text("Использование: /check @username")
-        return asyncio.create_task(delete_later(msg))
+        return sender.reply(update.message, "Использование: /check @username", autodelete=True)
     
-    username = context.args[0].strip()
-    if username in OFFICIAL_USERS:
-        msg = await update.message.reply_text("✅ Это официальный аккаунт.")
+    result = official_index.check(context.args[0])
+    if result[0] == "official":
+        text = f"✅ Это официальный аккаунт {result[1]}."
+    elif result[0] == "impersonating":
+        text = f"‼⚠ Это подделка под {result[1]} (отличий: {result[2]})! ⚠‼"
     else:
-        msg = await update.message.reply_text("‼⚠ Это НЕ официальный аккаунт! ⚠‼")
+        text = "‼⚠ Это НЕ официальный аккаунт! ⚠‼"
     
     # Результат проверки удаляется, но сообщение с командой /check остается
-    asyncio.create_task(delete_later(msg))
+    sender.reply(update.message, text, autodelete=True)
 
 async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
-        return await update.message.reply_text("Нет прав.")
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
     
-    STATS["admins_actions"] += 1
+    stats.hit("admins_actions", update.effective_chat.id)
     chat = update.effective_chat
     
     # Случай 1: Бан по ответу на сообщение
     if update.message.reply_to_message:
         user_id = update.message.reply_to_message.from_user.id
+        reason = " ".join(context.args) if context.args else "без указания причины"
         try:
             await chat.ban_member(user_id)
-            STATS["bans_issued"] += 1
-            reason = " ".join(context.args) if context.args else "без указания причины"
-            msg = await update.message.reply_text(
+            stats.hit("bans_issued", update.effective_chat.id)
+            audit.log(update, "ban", user_id, reason)
+            sender.reply(
+                update.message,
                 f"🚫 Пользователь {update.message.reply_to_message.from_user.full_name} "
-                f"(ID: {user_id}) забанен. Причина: {reason}"
+                f"(ID: {user_id}) забанен. Причина: {reason}",
+                priority=PRIO_ADMIN,
+                autodelete=True
             )
-            await update.message.reply_to_message.delete()
-            return asyncio.create_task(delete_later(msg))
+            return await update.message.reply_to_message.delete()
         except Exception as e:
-            return await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+            audit.log(update, "ban", user_id, reason, error=e)
+            return sender.reply(update.message, f"❌ Ошибка: {str(e)}", priority=PRIO_ADMIN)
     
-    # Случай 2: Бан по username (@username)
-    if context.args and context.args[0].startswith('@'):
-        username = context.args[0].strip()
-        try:
-            reason = " ".join(context.args[1:]) if len(context.args) > 1 else "без указания причины"
-            msg = await update.message.reply_text(
-                f"🚫 Для бана по username @{username} боту нужны специальные права.\n"
-                f"Используйте:\n"
-                f"1. Ответьте на сообщение пользователя командой /ban\n"
-                f"2. Используйте /ban <user_id> [причина]\n"
-                f"3. Или попросите пользователя написать что-то в чат, затем ответьте"
-            )
-            return asyncio.create_task(delete_later(msg))
-        except Exception as e:
-            return await update.message.reply_text(f"❌ Ошибка: {str(e)}")
-    
-    # Случай 3: Бан по ID (старая функциональность)
+    # Случай 2: Бан по ID или @username (ник ищется в индексе пользователей)
     if not context.args:
-        msg = await update.message.reply_text(
+        return sender.reply(
+            update.message,
             "Использование:\n"
             "1. /ban [причина] - в ответ на сообщение\n"
             "2. /ban @username [причина]\n"
-            "3. /ban <user_id> [причина]"
+            "3. /ban <user_id> [причина]\n"
+            "4. /ban <id или @username> <id или @username> ... -- [причина]",
+            priority=PRIO_ADMIN,
+            autodelete=True
         )
-        return asyncio.create_task(delete_later(msg))
+    
+    # Случай 3: Несколько целей до «--» - массовый бан с одной сводкой.
+    # Без разделителя числа в причине («/ban 123 3 раза спамил») не считаются целями
+    if "--" in context.args:
+        split = context.args.index("--")
+        targets = context.args[:split]
+        wrong = [arg for arg in targets if not is_user_arg(arg)]
+        if not targets or wrong:
+            return sender.reply(
+                update.message,
+                "❌ До «--» должны быть только ID или @username: " + " ".join(wrong),
+                priority=PRIO_ADMIN,
+                autodelete=True
+            )
+        return await ban_bulk(update, context, targets, " ".join(context.args[split + 1:]))
     
     try:
-        uid = int(context.args[0])
+        uid = resolve_user_arg(context.args[0])
         reason = " ".join(context.args[1:]) if len(context.args) > 1 else "без указания причины"
         await chat.ban_member(uid)
-        STATS["bans_issued"] += 1
-        msg = await update.message.reply_text(f"🚫 Пользователь {uid} забанен. Причина: {reason}")
-        asyncio.create_task(delete_later(msg))
+        stats.hit("bans_issued", update.effective_chat.id)
+        audit.log(update, "ban", uid, reason)
+        sender.reply(
+            update.message,
+            f"🚫 Пользователь {uid} забанен. Причина: {reason}",
+            priority=PRIO_ADMIN,
+            autodelete=True
+        )
     except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+        audit.log(update, "ban", context.args[0], error=e)
+        sender.reply(update.message, f"❌ Ошибка: {str(e)}", priority=PRIO_ADMIN)
 
 async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
-        return await update.message.reply_text("Нет прав.")
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
     
-    STATS["admins_actions"] += 1
+    stats.hit("admins_actions", update.effective_chat.id)
     
     # Разбан по ответу на сообщение
     if update.message.reply_to_message:
         user_id = update.message.reply_to_message.from_user.id
         try:
             await update.effective_chat.unban_member(user_id)
-            msg = await update.message.reply_text(
+            audit.log(update, "unban", user_id)
+            return sender.reply(
+                update.message,
                 f"✅ Пользователь {update.message.reply_to_message.from_user.full_name} "
-                f"(ID: {user_id}) разбанен."
+                f"(ID: {user_id}) разбанен.",
+                priority=PRIO_ADMIN,
+                autodelete=True
             )
-            return asyncio.create_task(delete_later(msg))
         except Exception as e:
-            await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+            audit.log(update, "unban", user_id, error=e)
+            sender.reply(update.message, f"❌ Ошибка: {str(e)}", priority=PRIO_ADMIN)
     
-    # Разбан по ID
+    # Разбан по ID или @username
     if not context.args:
-        msg = await update.message.reply_text(
+        return sender.reply(
+            update.message,
             "Использование:\n"
             "1. /unban - в ответ на сообщение\n"
-            "2. /unban <user_id>"
+            "2. /unban <user_id или @username>",
+            priority=PRIO_ADMIN,
+            autodelete=True
         )
-        return asyncio.create_task(delete_later(msg))
     
     try:
-        uid = int(context.args[0])
+        uid = resolve_user_arg(context.args[0])
         await update.effective_chat.unban_member(uid)
-        msg = await update.message.reply_text(f"✅ Пользователь {uid} разбанен.")
-        asyncio.create_task(delete_later(msg))
+        audit.log(update, "unban", uid)
+        sender.reply(update.message, f"✅ Пользователь {uid} разбанен.", priority=PRIO_ADMIN, autodelete=True)
     except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+        audit.log(update, "unban", context.args[0], error=e)
+        sender.reply(update.message, f"❌ Ошибка: {str(e)}", priority=PRIO_ADMIN)
 
 async def kick_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
-        return await update.message.reply_text("Нет прав.")
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
     
-    STATS["admins_actions"] += 1
-    STATS["kicks_issued"] += 1
+    stats.hit("admins_actions", update.effective_chat.id)
+    stats.hit("kicks_issued", update.effective_chat.id)
     
     # Кик по ответу на сообщение
     if update.message.reply_to_message:
         user_id = update.message.reply_to_message.from_user.id
+        reason = " ".join(context.args) if context.args else "без указания причины"
         try:
             await update.effective_chat.ban_member(user_id)
             await update.effective_chat.unban_member(user_id)
-            reason = " ".join(context.args) if context.args else "без указания причины"
-            msg = await update.message.reply_text(
+            audit.log(update, "kick", user_id, reason)
+            sender.reply(
+                update.message,
                 f"👢 Пользователь {update.message.reply_to_message.from_user.full_name} "
-                f"(ID: {user_id}) кикнут. Причина: {reason}"
+                f"(ID: {user_id}) кикнут. Причина: {reason}",
+                priority=PRIO_ADMIN,
+                autodelete=True
             )
-            await update.message.reply_to_message.delete()
-            return asyncio.create_task(delete_later(msg))
+            return await update.message.reply_to_message.delete()
         except Exception as e:
-            await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+            audit.log(update, "kick", user_id, reason, error=e)
+            sender.reply(update.message, f"❌ Ошибка: {str(e)}", priority=PRIO_ADMIN)
     
-    # Кик по ID
+    # Кик по ID или @username
     if not context.args:
-        msg = await update.message.reply_text(
+        return sender.reply(
+            update.message,
             "Использование:\n"
             "1. /kick [причина] - в ответ на сообщение\n"
-            "2. /kick <user_id> [причина]"
+            "2. /kick <user_id или @username> [причина]",
+            priority=PRIO_ADMIN,
+            autodelete=True
         )
-        return asyncio.create_task(delete_later(msg))
     
     try:
-        uid = int(context.args[0])
+        uid = resolve_user_arg(context.args[0])
         reason = " ".join(context.args[1:]) if len(context.args) > 1 else "без указания причины"
         await update.effective_chat.ban_member(uid)
         await update.effective_chat.unban_member(uid)
-        msg = await update.message.reply_text(f"👢 Пользователь {uid} кикнут. Причина: {reason}")
-        asyncio.create_task(delete_later(msg))
+        audit.log(update, "kick", uid, reason)
+        sender.reply(
+            update.message,
+            f"👢 Пользователь {uid} кикнут. Причина: {reason}",
+            priority=PRIO_ADMIN,
+            autodelete=True
+        )
     except Exception as e:
-        await update.message.reply_text(f"❌ Ошибка: {str(e)}")
+        audit.log(update, "kick", context.args[0], error=e)
+        sender.reply(update.message, f"❌ Ошибка: {str(e)}", priority=PRIO_ADMIN)
 
 async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
-        return await update.message.reply_text("Нет прав.")
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
     
-    STATS["admins_actions"] += 1
+    stats.hit("admins_actions", update.effective_chat.id)
     
     if not update.message.reply_to_message:
-        msg = await update.message.reply_text("Нужно ответить на сообщение.")
-        return asyncio.create_task(delete_later(msg))
+        return sender.reply(update.message, "Нужно ответить на сообщение.", priority=PRIO_ADMIN, autodelete=True)
     
+    target = update.message.reply_to_message
+    reason = f"сообщение {target.message_id}"
     try:
-        await update.message.reply_to_message.delete()
-        msg = await update.message.reply_text("🗑 Сообщение удалено.")
-        asyncio.create_task(delete_later(msg))
+        await target.delete()
+        audit.log(update, "delete", target.from_user.id, reason)
+        sender.reply(update.message, "🗑 Сообщение удалено.", priority=PRIO_ADMIN, autodelete=True)
     except Exception as e:
-        await update.message.reply_text(str(e))
+        audit.log(update, "delete", target.from_user.id, reason, error=e)
+        sender.reply(update.message, str(e), priority=PRIO_ADMIN)
+
+# ==================== МАССОВАЯ МОДЕРАЦИЯ ====================
+BAN_CONCURRENCY = 5  # сколько банов выполнять одновременно
+PURGE_MAX = 1000  # максимум сообщений за одну /purge
+BANCLEAN_DEFAULT = 100  # сколько сообщений удалять по /banclean без числа
+
+async def bulk_delete(bot, chat_id, ids):
+    """Удаляет сообщения пачками по DELETE_BATCH; возвращает число отправленных id"""
+    done = 0
+    ids = sorted(set(ids))
+    for i in range(0, len(ids), DELETE_BATCH):
+        batch = ids[i:i + DELETE_BATCH]
+        try:
+            await bot.delete_messages(chat_id, batch)
+            done += len(batch)
+        except TelegramError as e:
+            logger.warning("deleteMessages в %s не удался: %s", chat_id, e)
+    return done
+
+async def ban_many(chat, user_ids, admin_id, reason=None):
+    """Банит пользователей параллельно (не больше BAN_CONCURRENCY); [(user_id, ошибка или None)]"""
+    limit = asyncio.Semaphore(BAN_CONCURRENCY)
+    
+    async def ban_one(user_id):
+        async with limit:
+            try:
+                await chat.ban_member(user_id)
+                stats.hit("bans_issued", chat.id)
+                audit.add("ban", chat.id, admin_id, user_id, reason)
+                return user_id, None
+            except TelegramError as e:
+                audit.add("ban", chat.id, admin_id, user_id, reason, f"ошибка: {e}")
+                return user_id, str(e)
+    
+    return await asyncio.gather(*(ban_one(u) for u in user_ids))
+
+def ban_summary(title, results, deleted=None, reason=None):
+    ok = [u for u, err in results if err is None]
+    lines = [f"🚫 {title}: забанено {len(ok)} из {len(results)}."]
+    if deleted is not None:
+        lines.append(f"🗑 Удалено сообщений: {deleted}")
+    if reason:
+        lines.append(f"Причина: {reason}")
+    errors = [(u, err) for u, err in results if err is not None]
+    if errors:
+        lines.append("\nОшибки:")
+        lines.extend(f"• {u}: {err}" for u, err in errors[:20])
+    return "\n".join(lines)
+
+def is_user_arg(arg):
+    return arg.startswith("@") or arg.isdigit()
+
+async def ban_bulk(update, context, targets, reason):
+    """/ban id1 id2 @user3 ... -- [причина]"""
+    results = []
+    user_ids = []
+    for arg in targets:
+        try:
+            user_ids.append(resolve_user_arg(arg))
+        except ValueError as e:
+            results.append((arg, str(e)))
+    results = list(await ban_many(
+        update.effective_chat, dict.fromkeys(user_ids), update.effective_user.id, reason or None
+    )) + results
+    sender.reply(
+        update.message,
+        ban_summary("Массовый бан", results, reason=reason or "без указания причины"),
+        priority=PRIO_ADMIN,
+        autodelete=True
+    )
+
+async def purge_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/purge N - последние N сообщений; в ответ на сообщение - всё от него до команды"""
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
+    
+    msg = update.message
+    if msg.reply_to_message:
+        first = msg.reply_to_message.message_id
+    elif context.args and context.args[0].isdigit():
+        first = msg.message_id - int(context.args[0])
+    else:
+        return sender.reply(
+            msg,
+            "Использование:\n"
+            "1. /purge N - удалить последние N сообщений\n"
+            "2. /purge - в ответ на сообщение: удалить всё от него до команды",
+            priority=PRIO_ADMIN,
+            autodelete=True
+        )
+    
+    first = max(first, msg.message_id - PURGE_MAX, 1)
+    stats.hit("admins_actions", msg.chat_id)
+    deleted = await bulk_delete(context.bot, msg.chat_id, range(first, msg.message_id + 1))
+    audit.log(update, "purge", reason=f"{deleted} сообщений с {first}")
+    logger.info("Purge в %s: %s сообщений", msg.chat_id, deleted)
+    sender.send(msg.chat_id, f"🗑 Удалено сообщений: {deleted}", priority=PRIO_ADMIN, autodelete=True)
+
+async def banclean_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/banclean [N] в ответ или /banclean <user_id или @username> [N] - бан и удаление N его сообщений"""
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
+    
+    msg = update.message
+    args = list(context.args)
+    try:
+        if msg.reply_to_message:
+            user_id = msg.reply_to_message.from_user.id
+        elif args:
+            user_id = resolve_user_arg(args.pop(0))
+        else:
+            raise ValueError("укажите пользователя или ответьте на его сообщение")
+        limit = min(int(args[0]), HISTORY_SIZE) if args else BANCLEAN_DEFAULT
+    except ValueError as e:
+        return sender.reply(msg, f"❌ Ошибка: {e}", priority=PRIO_ADMIN, autodelete=True)
+    
+    stats.hit("admins_actions", msg.chat_id)
+    results = await ban_many(update.effective_chat, [user_id], update.effective_user.id, "banclean")
+    ids = history.by_user(msg.chat_id, user_id, limit)
+    if msg.reply_to_message:
+        ids.append(msg.reply_to_message.message_id)
+    deleted = await bulk_delete(context.bot, msg.chat_id, ids)
+    audit.log(update, "purge", user_id, f"{deleted} сообщений")
+    sender.reply(msg, ban_summary(f"Пользователь {user_id}", results, deleted), priority=PRIO_ADMIN, autodelete=True)
+
+async def banall_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/banall в ответ на сообщение - бан всех авторов ветки ответов и удаление ветки"""
+    if not await can_moderate(update, context):
+        return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
+    
+    msg = update.message
+    if not msg.reply_to_message:
+        return sender.reply(msg, "Нужно ответить на сообщение из ветки.", priority=PRIO_ADMIN, autodelete=True)
+    
+    root = msg.reply_to_message
+    thread = history.thread(msg.chat_id, root.message_id)
+    thread[root.message_id] = root.from_user.id
+    
+    # Модераторов и самого бота из ветки не трогаем
+    authors = set()
+    for user_id in set(thread.values()):
+        if user_id == context.bot.id or is_admin(user_id):
+            continue
+        if await chat_admins.status(context.bot, update.effective_chat, user_id):
+            continue
+        authors.add(user_id)
+    
+    stats.hit("admins_actions", msg.chat_id)
+    results = await ban_many(update.effective_chat, authors, update.effective_user.id, "banall")
+    spam_ids = [m for m, u in thread.items() if u in authors]
+    deleted = await bulk_delete(context.bot, msg.chat_id, spam_ids)
+    audit.log(update, "purge", reason=f"ветка {root.message_id}: {deleted} сообщений")
+    sender.reply(msg, ban_summary("Ветка", results, deleted), priority=PRIO_ADMIN, autodelete=True)
 
 async def chatinfo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = update.effective_chat
-    member = await chat.get_member(update.effective_user.id)
-    if isinstance(member, ChatMemberOwner):
+    status = await chat_admins.status(context.bot, chat, update.effective_user.id)
+    if status == "creator":
         role = "Создатель"
-    elif isinstance(member, ChatMemberAdministrator):
+    elif status == "administrator":
         role = "Админ"
     else:
         role = "Участник"
@@ -320,19 +2260,17 @@ async def chatinfo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Тип: {chat.type}\n"
         f"Ваша роль: {role}"
     )
-    await update.message.reply_text(text)
+    sender.reply(update.message, text)
 
 async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
-        out = await update.message.reply_text("⛔ У вас нет прав администратора.")
-        return asyncio.create_task(delete_later(out))
+    if not is_admin(update.effective_user.id):
+        return sender.reply(update.message, "⛔ У вас нет прав администратора.", autodelete=True)
     
-    STATS["admins_actions"] += 1
-    out = await update.message.reply_text("🔧 Панель администратора", reply_markup=ADMIN_PANEL)
-    asyncio.create_task(delete_later(out))
+    stats.hit("admins_actions", update.effective_chat.id)
+    sender.reply(update.message, "🔧 Панель администратора", autodelete=True, reply_markup=ADMIN_PANEL)
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
+    if not is_admin(update.effective_user.id):
         return
     
     text = (
@@ -343,166 +2281,866 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"🚫 Выдано банов: {STATS['bans_issued']}\n"
         f"👢 Выдано киков: {STATS['kicks_issued']}\n"
         f"🛡 Действий админов: {STATS['admins_actions']}\n"
-        f"✅ Проверок аккаунтов: {STATS['checks_performed']}\n\n"
-        f"👑 Активных админов: {len(ADMINS)}\n"
-        f"📅 Обновлено: {len(STATS)} показателей"
+        f"✅ Проверок аккаунтов: {STATS['checks_performed']}\n"
+        f"🔎 Inline-запросов: {STATS['inline_queries']}\n\n"
+        f"👑 Активных админов: {len(config.admins)}\n"
+        f"📅 Обновлено: {len(STATS)} показателей\n\n"
+        + render_periods()
     )
-    await update.message.reply_text(text)
+    sender.reply(update.message, text)
+
+AUDIT_ACTIONS = {
+    "ban", "unban", "kick", "mute", "delete", "purge", "spam",
+    "admin_add", "settext", "trigger_add", "trigger_del", "chatconfig",
+}
+
+def render_audit(records):
+    lines = []
+    for r in records:
+        when = time.strftime("%d.%m %H:%M", time.localtime(r["ts"]))
+        who = r["admin"] or "бот"
+        line = f"{when} {r['action']}"
+        if r["target"] is not None:
+            line += f" {r['target']}"
+        line += f" ← {who}"
+        if r["reason"]:
+            line += f": {r['reason']}"
+        if r["result"] != "ok":
+            line += f" ❌ {r['result']}"
+        lines.append(line)
+    text = "\n".join(lines)
+    return text if len(text) <= 4000 else text[:4000] + "\n…"
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/audit [@username или user_id] [действие] [N] - журнал модерации.
+
+    В группе показывает только этот чат, в личке админам бота - все чаты.
+    """
+    chat = update.effective_chat
+    if chat.type == "private":
+        if not is_admin(update.effective_user.id):
+            return sender.reply(update.message, "Нет прав.", autodelete=True)
+        chat_id = None
+    else:
+        if not await can_moderate(update, context):
+            return sender.reply(update.message, "Нет прав.", priority=PRIO_ADMIN)
+        chat_id = chat.id
+    
+    target = action = None
+    limit = AUDIT_DEFAULT_LIMIT
+    try:
+        for arg in context.args:
+            if arg.lower() in AUDIT_ACTIONS:
+                action = arg.lower()
+            elif arg.isdigit() and int(arg) <= AUDIT_MAX_LIMIT:
+                limit = int(arg)
+            else:
+                target = resolve_user_arg(arg)
+    except ValueError as e:
+        return sender.reply(update.message, f"❌ Ошибка: {e}", priority=PRIO_ADMIN, autodelete=True)
+    
+    records = await audit.query(limit, chat_id, target, action)
+    if not records:
+        text = "📜 Записей не найдено."
+    else:
+        text = f"📜 Журнал модерации ({len(records)}):\n\n" + render_audit(records)
+    sender.reply(update.message, text, priority=PRIO_ADMIN, autodelete=True)
 
 async def settext_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if update.effective_user.id not in ADMINS:
-        out = await update.message.reply_text("Нет прав.")
-        return asyncio.create_task(delete_later(out))
+    if not is_admin(update.effective_user.id):
+        return sender.reply(update.message, "Нет прав.", autodelete=True)
     
-    STATS["admins_actions"] += 1
+    stats.hit("admins_actions", update.effective_chat.id)
     
     if not context.args:
-        out = await update.message.reply_text(
-            "Использование:\n"
-            "/settext keywords\n"
-            "/settext gpt\n"
-            "/settext suno\n"
-            "/settext google\n"
-            "/settext pay"
+        return sender.reply(
+            update.message,
+            "Использование:\n" + "\n".join(f"/settext {key}" for key in config.texts),
+            autodelete=True
         )
-        return asyncio.create_task(delete_later(out))
     
     key = context.args[0].lower()
-    allowed = {"keywords", "gpt", "suno", "google", "pay"}
-    if key not in allowed:
-        out = await update.message.reply_text("Неизвестный блок текста.")
-        return asyncio.create_task(delete_later(out))
+    if key not in config.texts:
+        return sender.reply(update.message, "Неизвестный блок текста.", autodelete=True)
     
     context.user_data["edit"] = key
-    out = await update.message.reply_text(f"Отправьте новый текст для {key.upper()}")
-    asyncio.create_task(delete_later(out))
+    context.user_data.pop("edit_chat", None)
+    sender.reply(update.message, f"Отправьте новый текст для {key.upper()}", autodelete=True)
+
+async def trigger_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Управление фразами-триггерами: /trigger add <блок> <фраза>, /trigger del <фраза>"""
+    if not is_admin(update.effective_user.id):
+        return sender.reply(update.message, "Нет прав.", autodelete=True)
+    
+    args = context.args
+    if len(args) >= 3 and args[0] == "add":
+        block = args[1].lower()
+        if block not in config.texts:
+            return sender.reply(
+                update.message,
+                "Неизвестный блок текста. Доступны: " + ", ".join(config.texts),
+                autodelete=True
+            )
+        phrase = " ".join(args[2:])
+        stats.hit("admins_actions", update.effective_chat.id)
+        set_trigger(phrase, block)
+        audit.log(update, "trigger_add", reason=f"{phrase} → {block}")
+        return sender.reply(update.message, f"✅ Триггер «{phrase}» → {block}", autodelete=True)
+    
+    if len(args) >= 2 and args[0] == "del":
+        phrase = " ".join(args[1:])
+        if phrase not in keywords.phrases:
+            return sender.reply(update.message, "Такого триггера нет.", autodelete=True)
+        stats.hit("admins_actions", update.effective_chat.id)
+        set_trigger(phrase)
+        audit.log(update, "trigger_del", reason=phrase)
+        return sender.reply(update.message, f"🗑 Триггер «{phrase}» удалён.", autodelete=True)
+    
+    listing = "\n".join(f"• {p} → {b}" for p, b in sorted(keywords.phrases.items()))
+    sender.reply(
+        update.message,
+        "Использование:\n"
+        "/trigger add <блок> <фраза>\n"
+        "/trigger del <фраза>\n\n"
+        f"Триггеры ({len(keywords.phrases)}):\n{listing}",
+        autodelete=True
+    )
+
+CHAT_FLAGS = {"on": True, "off": False}
+CHAT_FIELDS = ("texts", "triggers", "delete_after", "welcome", "buttons")
+
+def render_chat_profile(chat_id):
+    profile = config.chats.get(chat_id, {})
+    rules = chat_rules.get(chat_id)
+    own_triggers = [
+        f"• {phrase} → {block}" if block else f"• ✖ {phrase}"
+        for phrase, block in sorted(profile.get("triggers", {}).items())
+    ]
+    return (
+        f"📋 Профиль чата {chat_id}\n\n"
+        f"Удаление ответов через: {rules.delete_after} с\n"
+        f"Приветствие: {'вкл' if rules.welcome else 'выкл'}, "
+        f"кнопки: {'вкл' if rules.welcome_markup else 'выкл'}\n"
+        f"Свои тексты: {', '.join(sorted(profile.get('texts', {}))) or 'нет'}\n"
+        f"Свои триггеры:\n" + ("\n".join(own_triggers) or "нет")
+    )
+
+async def chatconfig_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Профиль текущего чата: свои тексты, триггеры и таймауты поверх общих"""
+    if not is_admin(update.effective_user.id):
+        return sender.reply(update.message, "Нет прав.", autodelete=True)
+    
+    chat_id = update.effective_chat.id
+    args = context.args
+    if not args:
+        return sender.reply(
+            update.message,
+            render_chat_profile(chat_id) + "\n\n"
+            "Использование:\n"
+            "/chatconfig delete_after <секунд>\n"
+            "/chatconfig welcome on|off\n"
+            "/chatconfig buttons on|off\n"
+            "/chatconfig text <блок> - затем отправьте текст\n"
+            "/chatconfig trigger <блок> <фраза>\n"
+            "/chatconfig untrigger <фраза>\n"
+            "/chatconfig reset [поле]",
+            autodelete=True
+        )
+    
+    field = args[0].lower()
+    if field == "delete_after" and len(args) == 2 and args[1].isdigit():
+        changes = {"delete_after": int(args[1])}
+    elif field in ("welcome", "buttons") and len(args) == 2 and args[1].lower() in CHAT_FLAGS:
+        # Значение по умолчанию не храним, чтобы чат следовал общим настройкам
+        changes = {field: None if CHAT_FLAGS[args[1].lower()] else False}
+    elif field == "text" and len(args) == 2 and args[1].lower() in config.texts:
+        context.user_data["edit"] = args[1].lower()
+        context.user_data["edit_chat"] = chat_id
+        return sender.reply(
+            update.message,
+            f"Отправьте новый текст для {args[1].upper()} в этом чате",
+            autodelete=True
+        )
+    elif field == "trigger" and len(args) >= 3 and args[1].lower() in config.texts:
+        phrase, block = " ".join(args[2:]), args[1].lower()
+        changes = {"triggers": lambda profile: {**profile.get("triggers", {}), phrase: block}}
+    elif field == "untrigger" and len(args) >= 2:
+        # null в профиле отключает и общую фразу
+        phrase = " ".join(args[1:])
+        changes = {"triggers": lambda profile: {**profile.get("triggers", {}), phrase: None}}
+    elif field == "reset":
+        changes = {args[1].lower(): None} if len(args) == 2 else dict.fromkeys(CHAT_FIELDS)
+    else:
+        return sender.reply(update.message, "❌ Неверные параметры. /chatconfig - справка", autodelete=True)
+    
+    stats.hit("admins_actions", chat_id)
+    config_store.update_chat(chat_id, **changes)
+    audit.log(update, "chatconfig", reason=" ".join(args))
+    sender.reply(update.message, "✔ Профиль чата обновлён.\n\n" + render_chat_profile(chat_id), autodelete=True)
 
 async def settext_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     key = context.user_data.get("edit")
     if not key:
         return
     
-    global KEYWORD_TEXT, GPT_TEXT, SUNO_TEXT, GOOGLE_TEXT, PAY_GUIDE
-    value = update.message.text
-    
-    if key == "keywords":
-        KEYWORD_TEXT = value
-    elif key == "gpt":
-        GPT_TEXT = value
-    elif key == "suno":
-        SUNO_TEXT = value
-    elif key == "google":
-        GOOGLE_TEXT = value
-    elif key == "pay":
-        PAY_GUIDE = value
-    
+    text = update.message.text
+    chat_id = context.user_data.pop("edit_chat", None)
+    if chat_id is None:
+        config_store.update(texts=lambda current: {**current.texts, key: text})
+    else:
+        config_store.update_chat(chat_id, texts=lambda profile: {**profile.get("texts", {}), key: text})
+    audit.log(update, "settext", reason=key if chat_id is None else f"{key} для чата {chat_id}")
     context.user_data.pop("edit", None)
-    out = await update.message.reply_text("✔ Текст обновлён!")
-    asyncio.create_task(delete_later(out))
+    sender.reply(update.message, "✔ Текст обновлён!", autodelete=True)
+
+# ==================== МЕНЮ ====================
+# Экран -> экран, куда ведёт кнопка «Назад»
+MENU_PARENT = {
+    "accounts": "main",
+    "how_pay": "main",
+    "alipay": "main",
+    "pay_gpt": "how_pay",
+    "pay_suno": "how_pay",
+    "pay_google": "how_pay",
+    "admin_list": "admin",
+    "stats": "admin",
+    "admin_add": "admin",
+    "admin_edit": "admin",
+}
+
+def with_back(parent, markup=None):
+    rows = list(markup.inline_keyboard) if markup else []
+    rows.append([InlineKeyboardButton("⬅️ Назад", callback_data=parent)])
+    return InlineKeyboardMarkup(rows)
+
+def render_screen(key, texts):
+    """(текст, клавиатура) экрана меню или None для неизвестного ключа; texts - тексты чата"""
+    if key == "main":
+        return render_welcome(texts["welcome"], "клиент"), MAIN_BUTTONS
+    if key == "admin":
+        return "🔧 Панель администратора", ADMIN_PANEL
+    
+    if key == "accounts":
+        formatted = "\n".join(f"{u} — {v}" for u, v in config.official.items())
+        text = "Официальные аккаунты:\n" + formatted
+    elif key == "how_pay":
+        return texts["pay"], with_back("main", PAY_BUTTONS)
+    elif key == "alipay":
+        # Кнопка сохранена, но функциональность удалена
+        text = "ℹ️ Информация по Alipay временно недоступна."
+    elif key == "pay_gpt":
+        text = texts["gpt"]
+    elif key == "pay_suno":
+        text = texts["suno"]
+    elif key == "pay_google":
+        text = texts["google"]
+    elif key == "admin_list":
+        admin_list = "\n".join([f"• {admin_id}" for admin_id in sorted(config.admins)])
+        text = f"📋 Список админов:\n{admin_list}"
+    elif key == "admin_add":
+        text = "Введите ID пользователя, которого хотите сделать админом:"
+    elif key == "admin_edit":
+        text = (
+            "📝 Изменить текст:\n"
+            + "\n".join(f"/settext {key}" for key in config.texts)
+        )
+    else:
+        return None
+    return text, with_back(MENU_PARENT[key])
+
+def render_stats_screen():
+    text = (
+        f"📊 **СТАТИСТИКА**\n\n"
+        f"📨 Сообщений: {STATS['messages_processed']}\n"
+        f"🚫 Банов: {STATS['bans_issued']}\n"
+        f"👑 Админов: {len(config.admins)}\n"
+        f"✅ Проверок: {STATS['checks_performed']}\n\n"
+        + render_periods()
+    )
+    return text, with_back("admin")
+
+class MenuCache:
+    """Готовые экраны меню; сбрасываются при каждой новой версии config.
+
+    Экраны рисуются из текстов чата (/chatconfig text), ключ - (правила чата,
+    экран): чаты без своего профиля делят одни правила и один набор экранов.
+    """
+
+    def __init__(self):
+        self.screens = {}
+        self.version = None
+
+    def get(self, chat_id, key):
+        rules = chat_rules.get(chat_id)
+        if self.version != config.version:
+            self.version = config.version
+            self.screens.clear()
+        screen = self.screens.get((rules, key))
+        if screen is None:
+            screen = render_screen(key, rules.texts)
+            if screen is not None:
+                self.screens[rules, key] = screen
+        return screen
+
+menu = MenuCache()
 
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     d = q.data
-    STATS["keywords_triggered"] += 1
-    
-    if d == "accounts":
-        formatted = "\n".join(f"{u} — {v}" for u, v in OFFICIAL_USERS.items())
-        out = await q.message.reply_text("Официальные аккаунты:\n" + formatted)
-    elif d == "how_pay":
-        out = await q.message.reply_text(PAY_GUIDE, reply_markup=PAY_BUTTONS)
-    elif d == "alipay":
-        # Кнопка сохранена, но функциональность удалена
-        out = await q.message.reply_text("ℹ️ Информация по Alipay временно недоступна.")
-    elif d == "pay_gpt":
-        out = await q.message.reply_text(GPT_TEXT)
-    elif d == "pay_suno":
-        out = await q.message.reply_text(SUNO_TEXT)
-    elif d == "pay_google":
-        out = await q.message.reply_text(GOOGLE_TEXT)
-    elif d == "admin_list":
-        admin_list = "\n".join([f"• {admin_id}" for admin_id in ADMINS])
-        out = await q.message.reply_text(f"📋 Список админов:\n{admin_list}")
-    elif d == "stats":
-        text = (
-            f"📊 **СТАТИСТИКА**\n\n"
-            f"📨 Сообщений: {STATS['messages_processed']}\n"
-            f"🚫 Банов: {STATS['bans_issued']}\n"
-            f"👑 Админов: {len(ADMINS)}\n"
-            f"✅ Проверок: {STATS['checks_performed']}"
-        )
-        out = await q.message.reply_text(text)
-    elif d == "admin_add":
+    stats.hit("keywords_triggered", q.message.chat_id)
+    
+    if d == "stats":
+        screen = render_stats_screen()
+    else:
+        screen = menu.get(q.message.chat_id, d)
+    if screen is None:
+        return
+    if d == "admin_add":
         context.user_data["wait_admin_id"] = True
-        out = await q.message.reply_text("Введите ID пользователя, которого хотите сделать админом:")
-    elif d == "admin_edit":
-        out = await q.message.reply_text(
-            "📝 Изменить текст:\n"
-            "/settext keywords\n/settext gpt\n/settext suno\n/settext google\n/settext pay"
-        )
     
-    # Сообщения от кнопок удаляются через время
-    asyncio.create_task(delete_later(out))
+    # Меню листается в том же сообщении; одинаковый экран не перерисовывается
+    text, markup = screen
+    if q.message.text == text and q.message.reply_markup == markup:
+        return
+    sender.submit(
+        q.message.chat_id,
+        lambda: q.edit_message_text(text, reply_markup=markup)
+    )
+
+# ==================== INLINE-ПРОВЕРКА ====================
+INLINE_CACHE_TIME = 300  # сколько секунд Telegram может отдавать ответ из своего кэша
+INLINE_CACHE_SIZE = 10000  # сколько разных запросов помнить у себя
+
+def inline_article(result_id, title, text, description=None):
+    return InlineQueryResultArticle(
+        id=result_id,
+        title=title,
+        description=description,
+        input_message_content=InputTextMessageContent(text)
+    )
+
+def render_inline(key):
+    """Ответ на inline-запрос по нормализованному нику (пустой - список официальных)"""
+    if not key:
+        listing = "\n".join(f"✅ {u}" for u in sorted(config.official))
+        return [inline_article(
+            "official",
+            "🔐 Официальные аккаунты",
+            f"🔐 Официальные аккаунты:\n\n{listing}",
+            "Введите @username, чтобы проверить аккаунт"
+        )]
+    
+    username = "@" + key
+    result = official_index.check(username)
+    if result[0] == "official":
+        title = f"✅ {result[1]} - официальный аккаунт"
+        text = f"✅ {result[1]} - официальный аккаунт."
+    elif result[0] == "impersonating":
+        title = f"‼ {username} - ПОДДЕЛКА под {result[1]}"
+        text = f"‼⚠ {username} - это подделка под {result[1]} (отличий: {result[2]})! ⚠‼"
+    else:
+        title = f"‼ {username} - НЕ официальный аккаунт"
+        text = f"‼⚠ {username} - это НЕ официальный аккаунт! ⚠‼"
+    return [inline_article(f"check:{key}"[:64], title, text, "Нажмите, чтобы отправить результат в чат")]
+
+class InlineCache:
+    """LRU нормализованный запрос -> готовые результаты; сбрасывается с новой версией config"""
+
+    def __init__(self, size):
+        self.size = size
+        self.results = OrderedDict()
+        self.version = None
+
+    def get(self, query):
+        if self.version != config.version:
+            self.version = config.version
+            self.results.clear()
+        # Ник можно вставить и ссылкой t.me/username
+        key = username_key(query.split()[0].rsplit("/", 1)[-1]) if query.strip() else ""
+        results = self.results.get(key)
+        if results is not None:
+            self.results.move_to_end(key)
+            return results
+        results = self.results[key] = render_inline(key)
+        if len(self.results) > self.size:
+            self.results.popitem(last=False)
+        return results
+
+inline_cache = InlineCache(INLINE_CACHE_SIZE)
+
+async def inline_check(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """@бот @username в любом чате - проверка аккаунта без сообщения в группе"""
+    query = update.inline_query
+    stats.hit("inline_queries")
+    try:
+        # Ответ одинаков для всех, поэтому его можно кэшировать и на стороне Telegram
+        await query.answer(inline_cache.get(query.query), cache_time=INLINE_CACHE_TIME, is_personal=False)
+    except TelegramError as e:
+        logger.debug("Inline-ответ не отправлен: %s", e)
 
 async def text_router(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    STATS["messages_processed"] += 1
+    stats.hit("messages_processed", update.effective_chat.id)
     msg = update.message
     if not msg or not msg.text:
         return
     
     text = msg.text.strip()
-    low = text.lower()
     
-    if update.effective_user.id in ADMINS and context.user_data.get("wait_admin_id"):
+    if is_admin(update.effective_user.id) and context.user_data.get("wait_admin_id"):
         try:
             uid = int(text)
-            if uid not in ADMINS:
-                ADMINS.append(uid)
-                STATS["admins_actions"] += 1
-                out = await msg.reply_text(f"✅ Админ добавлен: {uid}")
+            if not is_admin(uid):
+                config_store.update(admins=lambda current: current.admins | {uid})
+                stats.hit("admins_actions", update.effective_chat.id)
+                audit.log(update, "admin_add", uid)
+                out = f"✅ Админ добавлен: {uid}"
             else:
-                out = await msg.reply_text("⚠ Этот пользователь уже админ.")
+                out = "⚠ Этот пользователь уже админ."
         except:
-            out = await msg.reply_text("❌ ID должен быть числом.")
+            out = "❌ ID должен быть числом."
         context.user_data.pop("wait_admin_id")
-        return asyncio.create_task(delete_later(out))
+        return sender.reply(msg, out, priority=PRIO_ADMIN, autodelete=True)
     
-    if update.effective_user.id in ADMINS and context.user_data.get("edit"):
+    if is_admin(update.effective_user.id) and context.user_data.get("edit"):
         return await settext_apply(update, context)
     
+    normalized = normalize_text(text)
+    rules = chat_rules.get(msg.chat_id)
+    block = rules.keywords.match(normalized)
+    
+    # Админов бота и чата не проверяем, как в flood_guard. Сообщения с ключевыми
+    # словами тоже учитываются: до порога рассылки на них просто отвечают
+    user_id = update.effective_user.id
+    suspect = len(normalized) >= SPAM_MIN_LEN and not is_admin(user_id)
+    if suspect and not await chat_admins.status(context.bot, update.effective_chat, user_id):
+        found = spam.check(normalized, msg.chat_id, user_id, msg.message_id)
+        if found:
+            logger.info("Рассылка от %s в %s, удаляется %s сообщений", user_id, msg.chat_id, len(found))
+            audit.add("spam", msg.chat_id, 0, user_id, f"удалено {len(found)} сообщений")
+            return await delete_spam(context.bot, found)
+    
     if text.startswith("@") and " " not in text:
         return await check_username(update, context)
     
-    if "как купить" in low or "как оплатить" in low or "как перевести" in low:
-        STATS["keywords_triggered"] += 1
-        out = await msg.reply_text(KEYWORD_TEXT)
-        return asyncio.create_task(delete_later(out))
+    if block:
+        stats.hit("keywords_triggered", update.effective_chat.id)
+        reply = rules.texts.get(block)
+        if reply:
+            return sender.reply(msg, reply, priority=PRIO_LOW, autodelete=True, dedup=True)
 
-def main():
-    if not TOKEN:
-        print("❌ BOT_TOKEN не найден!")
+# ==================== ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ====================
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))  # апдейтов одновременно
+
+def update_keys(update):
+    """Ключи очередности апдейта: его чат и, для админа бота, его автор"""
+    keys = []
+    chat = getattr(update, "effective_chat", None)
+    if chat:
+        keys.append(("chat", chat.id))
+    # Очередь автора связала бы все чаты, где он пишет: медленный бан в одном
+    # задерживал бы весь другой. Состояния в user_data бывают только у админов
+    user = getattr(update, "effective_user", None)
+    if user and is_admin(user.id):
+        keys.append(("user", user.id))
+    return keys
+
+class ChatOrderedProcessor(BaseUpdateProcessor):
+    """Апдейты разных чатов идут параллельно, одного чата (и одного админа) - строго по очереди.
+
+    Очередь админа нужна для состояний в user_data (wait_admin_id, settext):
+    админ может начать действие в одном чате, а закончить в другом.
+    Каждый апдейт ждёт только предыдущий апдейт по своим ключам, поэтому
+    цепочки получаются в порядке поступления. Счётчики STATS и настройки config
+    меняются без await внутри, так что гонок между корутинами нет.
+    """
+
+    def __init__(self, limit):
+        # Ограничение базового класса срабатывало бы до ожидания очереди чата:
+        # ждущие апдейты занимали бы слоты. Поэтому лимит держим сами, после очереди.
+        super().__init__(1 << 30)
+        self.limit = asyncio.Semaphore(limit)
+        self.tails = {}
+        # Принятые, но ещё не обработанные апдейты. Задача на апдейт создаётся
+        # сразу, поэтому update_queue почти всегда пуста, и отставание видно только здесь
+        self.pending = 0
+
+    async def do_process_update(self, update, coroutine):
+        self.pending += 1
+        keys = update_keys(update)
+        done = asyncio.get_running_loop().create_future()
+        previous = {self.tails[k] for k in keys if k in self.tails}
+        for k in keys:
+            self.tails[k] = done
+        try:
+            for future in previous:
+                await future
+            async with self.limit:
+                await coroutine
+        finally:
+            self.pending -= 1
+            done.set_result(None)
+            for k in keys:
+                if self.tails.get(k) is done:
+                    del self.tails[k]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+def update_backlog(app):
+    """Сколько апдейтов принято, но ещё не обработано"""
+    return app.update_queue.qsize() + getattr(app.update_processor, "pending", 0)
+
+# ==================== МЕТРИКИ ====================
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))  # 0 - не поднимать /metrics
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Metrics:
+    """Гистограммы задержек обработчиков и вызовов Bot API, счётчики ошибок"""
+
+    def __init__(self):
+        self.handlers = {}
+        self.api = {}
+        self.errors = {}  # (источник, имя, тип исключения) -> количество
+        self.app = None
+
+    def observe(self, table, name, seconds):
+        hist = table.get(name)
+        if hist is None:
+            hist = table[name] = Histogram()
+        hist.observe(seconds)
+
+    def error(self, source, name, exc):
+        key = (source, name, type(exc).__name__)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def render(self):
+        """Все метрики в текстовом формате Prometheus"""
+        out = []
+        for metric, label, table in (
+            ("bot_handler_seconds", "handler", self.handlers),
+            ("bot_api_seconds", "method", self.api),
+        ):
+            out.append(f"# TYPE {metric} histogram")
+            for name, hist in sorted(table.items()):
+                cumulative = 0
+                for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), hist.counts):
+                    cumulative += n
+                    out.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                out.append(f'{metric}_sum{{{label}="{name}"}} {hist.total:.6f}')
+                out.append(f'{metric}_count{{{label}="{name}"}} {hist.count}')
+        
+        out.append("# TYPE bot_errors_total counter")
+        for (source, name, kind), n in sorted(self.errors.items()):
+            out.append(f'bot_errors_total{{source="{source}",name="{name}",type="{kind}"}} {n}')
+        
+        out.append("# TYPE bot_events_total counter")
+        for name, n in sorted(STATS.items()):
+            out.append(f'bot_events_total{{name="{name}"}} {n}')
+        
+        gauges = {
+            "bot_update_queue_size": update_backlog(self.app) if self.app else 0,
+            "bot_send_queue_size": len(sender),
+            "bot_pending_deletes": len(deleter),
+            "bot_asyncio_tasks": len(asyncio.all_tasks()),
+        }
+        for name, value in gauges.items():
+            out.append(f"# TYPE {name} gauge")
+            out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
+
+metrics = Metrics()
+
+def timed(callback):
+    """Оборачивает обработчик: задержка и ошибки попадают в metrics"""
+    name = callback.__name__
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception as e:
+            metrics.error("handler", name, e)
+            raise
+        finally:
+            metrics.observe(metrics.handlers, name, time.perf_counter() - start)
+
+    return wrapper
+
+class TimedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый вызов Bot API"""
+
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            return await super().post(url, *args, **kwargs)
+        except Exception as e:
+            metrics.error("api", method, e)
+            raise
+        finally:
+            metrics.observe(metrics.api, method, time.perf_counter() - start)
+
+HTTP_MAX_BODY = 1 << 20
+
+async def read_http_request(reader):
+    """(метод, путь, заголовки, тело) одного HTTP-запроса"""
+    request = (await reader.readline()).decode("latin-1").split()
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = min(int(headers.get("content-length") or 0), HTTP_MAX_BODY)
+    body = await reader.readexactly(length) if length else b""
+    method, path = (request + ["", ""])[:2]
+    return method, path, headers, body
+
+async def write_http_response(writer, status, body=b"", content_type="text/plain; charset=utf-8"):
+    writer.write(
+        f"HTTP/1.1 {status}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        f"Connection: close\r\n\r\n".encode() + body
+    )
+    await writer.drain()
+
+async def serve_metrics(reader, writer):
+    try:
+        _, path, _, _ = await read_http_request(reader)
+        if path == "/metrics":
+            await write_http_response(writer, "200 OK", metrics.render().encode(), "text/plain; version=0.0.4")
+        else:
+            await write_http_response(writer, "404 Not Found", b"not found\n")
+    except Exception as e:
+        logger.debug("Ошибка /metrics: %s", e)
+    finally:
+        writer.close()
+
+# ==================== ВЕБХУК ====================
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # "polling" или "webhook"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный адрес; без него вебхук не регистрируется
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # без него - только локально, см. run_webhook
+WEBHOOK_QUEUE = 1000  # сколько апдейтов может ждать обработки, дальше - 503
+
+class WebhookServer:
+    """Встроенный HTTP-сервер вебхука.
+
+    Запрос только проверяет секрет и кладёт тело в ограниченную очередь -
+    Telegram получает ответ сразу. Разбор и обработка идут отдельно; если
+    очередь полна, отвечаем 503, и Telegram повторит доставку позже.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.intake = asyncio.Queue(WEBHOOK_QUEUE)
+        self.server = None
+        self.task = None
+
+    async def handle(self, reader, writer):
+        try:
+            method, path, headers, body = await read_http_request(reader)
+            if method != "POST" or path != WEBHOOK_PATH:
+                return await write_http_response(writer, "404 Not Found")
+            secret = headers.get("x-telegram-bot-api-secret-token", "").encode()
+            if WEBHOOK_SECRET and not hmac.compare_digest(secret, WEBHOOK_SECRET.encode()):
+                return await write_http_response(writer, "403 Forbidden")
+            try:
+                self.intake.put_nowait(body)
+            except asyncio.QueueFull:
+                return await write_http_response(writer, "503 Service Unavailable")
+            await write_http_response(writer, "200 OK")
+        except Exception as e:
+            logger.debug("Ошибка запроса вебхука: %s", e)
+        finally:
+            writer.close()
+
+    async def feed(self):
+        """Переносит апдейты из приёмной очереди в очередь приложения"""
+        while True:
+            body = await self.intake.get()
+            try:
+                while update_backlog(self.app) >= WEBHOOK_QUEUE:
+                    await asyncio.sleep(0.05)
+                update = Update.de_json(json.loads(body), self.app.bot)
+                await self.app.update_queue.put(update)
+            except Exception as e:
+                logger.warning("Не удалось разобрать апдейт вебхука: %s", e)
+            finally:
+                self.intake.task_done()
+
+    async def start(self):
+        if WEBHOOK_URL:
+            await self.app.bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=100
+            )
+        self.task = asyncio.create_task(self.feed())
+        self.server = await asyncio.start_server(self.handle, WEBHOOK_LISTEN, WEBHOOK_PORT)
+        logger.info("Вебхук слушает %s:%s%s", WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    async def stop(self):
+        # новые запросы больше не принимаются, уже принятые дорабатываются
+        self.server.close()
+        await self.server.wait_closed()
+        await self.intake.join()
+        self.task.cancel()
+
+async def run_webhook(app):
+    # без секрета любой, кто достучался до порта, может прислать апдейт
+    # от имени админа; так можно только для локального прогона без регистрации
+    if not WEBHOOK_SECRET and (WEBHOOK_URL or WEBHOOK_LISTEN != "127.0.0.1"):
+        print("❌ Для вебхука нужен WEBHOOK_SECRET (без него - только WEBHOOK_LISTEN=127.0.0.1 без WEBHOOK_URL)")
         return
     
-    app = Application.builder().token(TOKEN).build()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    await app.initialize()
+    await on_startup(app)
+    webhook = WebhookServer(app)
+    await webhook.start()
+    await app.start()
+    try:
+        await stop.wait()
+    finally:
+        await webhook.stop()
+        # stop() дожидается обработки всего, что уже лежит в update_queue
+        await app.stop()
+        await on_shutdown(app)
+        await app.shutdown()
+
+async def on_startup(app: Application):
+    deleter.load()
+    load_triggers()
+    config_store.load()
+    config_store.task = asyncio.create_task(config_store.run())
+    users.load()
+    users.task = asyncio.create_task(users.run())
+    stats.load()
+    stats.task = asyncio.create_task(stats.run())
+    audit.load()
+    audit.task = asyncio.create_task(audit.run())
+    deleter.task = asyncio.create_task(deleter.run(app.bot))
+    sender.bot = app.bot
+    sender.task = asyncio.create_task(sender.run())
+    metrics.app = app
+    if METRICS_PORT:
+        app.bot_data["metrics_server"] = await asyncio.start_server(serve_metrics, METRICS_HOST, METRICS_PORT)
+
+async def on_shutdown(app: Application):
+    """Вызывается после остановки обработки апдейтов, пока бот ещё может отправлять"""
+    server = app.bot_data.pop("metrics_server", None)
+    if server:
+        server.close()
+    await welcomes.stop()
+    if deleter.task:
+        deleter.task.cancel()
+    if sender.task:
+        await sender.drain(SEND_DRAIN_TIMEOUT)
+        sender.task.cancel()
+    if users.task:
+        users.task.cancel()
+    if config_store.task:
+        config_store.task.cancel()
+    users.save()
+    if stats.task:
+        stats.task.cancel()
+    stats.save()
+    if audit.task:
+        audit.task.cancel()
+    audit.save()
+    deleter.save()
+    get_db().close()
+
+def build_app(token, base_url=None):
+    """Application со всеми обработчиками; base_url - другой сервер Bot API (bench.py)"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .request(TimedRequest(connection_pool_size=256))
+        .concurrent_updates(ChatOrderedProcessor(UPDATE_CONCURRENCY))
+        .post_init(on_startup)
+        # post_stop, а не post_shutdown: после shutdown HTTP-клиент бота уже закрыт
+        .post_stop(on_shutdown)
+    )
+    if base_url:
+        builder = builder.base_url(base_url)
+    app = builder.build()
     
     # Команды админов
+    app.add_handler(TypeHandler(Update, track_users), group=-2)
+    app.add_handler(MessageHandler(filters.ChatType.GROUPS, flood_guard), group=-1)
     app.add_handler(CommandHandler("ban", ban_command))
     app.add_handler(CommandHandler("unban", unban_command))
     app.add_handler(CommandHandler("kick", kick_command))
     app.add_handler(CommandHandler("delete", delete_command))
+    app.add_handler(CommandHandler("purge", purge_command))
+    app.add_handler(CommandHandler("banclean", banclean_command))
+    app.add_handler(CommandHandler("banall", banall_command))
     app.add_handler(CommandHandler("chatinfo", chatinfo_command))
     app.add_handler(CommandHandler("admin", admin_command))
     app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("audit", audit_command))
     app.add_handler(CommandHandler("settext", settext_start))
     app.add_handler(CommandHandler("check", check_command))
+    app.add_handler(CommandHandler("trigger", trigger_command))
+    app.add_handler(CommandHandler("chatconfig", chatconfig_command))
     
     # Обработчики сообщений
     app.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, welcome_new_member))
     app.add_handler(CallbackQueryHandler(button_handler))
+    app.add_handler(InlineQueryHandler(inline_check))
+    app.add_handler(ChatMemberHandler(track_chat_admins, ChatMemberHandler.ANY_CHAT_MEMBER))
     app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, text_router))
     
+    # Каждый обработчик замеряется для /metrics
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = timed(handler.callback)
+    return app
+
+def main():
+    if not TOKEN:
+        print("❌ BOT_TOKEN не найден!")
+        return
+    
+    app = build_app(TOKEN)
     print("🤖 Бот запущен!")
-    app.run_polling()
+    if BOT_MODE == "webhook":
+        asyncio.run(run_webhook(app))
+    else:
+        # chat_member приходит только если запросить его явно
+        app.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# bot.py читает окружение при импорте: база, конфиг и журнал - во временной папке
+WORKDIR = tempfile.mkdtemp(prefix="bot-tests-")
+os.environ["BOT_DB"] = os.path.join(WORKDIR, "bot.db")
+os.environ["BOT_CONFIG"] = os.path.join(WORKDIR, "config.json")
+os.environ["BOT_AUDIT_DIR"] = os.path.join(WORKDIR, "audit")
+os.environ["METRICS_PORT"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,134 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import bot
+
+
+def make_update(chat_id, user_id):
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=chat_id),
+        effective_user=SimpleNamespace(id=user_id),
+    )
+
+
+async def run_all(processor, jobs):
+    """jobs: (update, coroutine) в порядке поступления, как их отдаёт Application"""
+    tasks = [asyncio.create_task(processor.process_update(u, c)) for u, c in jobs]
+    await asyncio.gather(*tasks)
+
+
+def admins(monkeypatch, *ids):
+    monkeypatch.setattr(bot, "is_admin", lambda user_id: user_id in ids)
+
+
+def test_same_chat_and_same_admin_keep_order(monkeypatch):
+    admins(monkeypatch, 10, 11)
+    rng = random.Random(1)
+    log = []
+
+    async def handler(chat_id, user_id, n):
+        await asyncio.sleep(rng.random() / 100)
+        log.append((chat_id, user_id, n))
+
+    async def main():
+        processor = bot.ChatOrderedProcessor(8)
+        jobs = []
+        for n in range(200):
+            chat_id, user_id = rng.choice([-1, -2, -3]), rng.choice([10, 11, 12, 13])
+            jobs.append((make_update(chat_id, user_id), handler(chat_id, user_id, n)))
+        await run_all(processor, jobs)
+        assert processor.pending == 0
+        assert not processor.tails
+
+    asyncio.run(main())
+    assert len(log) == 200
+    for key, values in ((0, (-1, -2, -3)), (1, (10, 11))):
+        for value in values:
+            seen = [n for *ids, n in log if ids[key] == value]
+            assert seen == sorted(seen)
+
+
+def test_different_chats_run_concurrently(monkeypatch):
+    admins(monkeypatch, 3)
+
+    async def main():
+        processor = bot.ChatOrderedProcessor(8)
+        started = asyncio.Event()
+        order = []
+
+        async def slow():
+            started.set()
+            await asyncio.sleep(0.05)
+            order.append("slow")
+
+        async def fast(name):
+            await started.wait()
+            order.append(name)
+
+        # пользователь 1 пишет в оба чата, но медленный апдейт в -1 не держит -2
+        task = asyncio.create_task(run_all(processor, [
+            (make_update(-1, 1), slow()),
+            (make_update(-2, 1), fast("shared user")),
+            (make_update(-2, 2), fast("fast")),
+        ]))
+        await asyncio.sleep(0.01)
+        # все апдейты приняты, медленный ещё не закончен
+        assert processor.pending == 3 - len(order)
+        await task
+        assert order == ["shared user", "fast", "slow"]
+
+        # а у админа бота очередь общая на все чаты
+        order.clear()
+        started.clear()
+        await run_all(processor, [
+            (make_update(-1, 3), slow()),
+            (make_update(-2, 3), fast("admin")),
+        ])
+        assert order == ["slow", "admin"]
+
+    asyncio.run(main())
+
+
+def test_wait_admin_id_across_chats(monkeypatch):
+    """Админ жмёт «Добавить админа» в одном чате, а ID присылает в другом"""
+    admins(monkeypatch, 42)
+    user_data = {}
+    answers = []
+
+    async def press_button():
+        await asyncio.sleep(0.02)  # q.answer() и прочие await до установки флага
+        user_data["wait_admin_id"] = True
+
+    async def send_id():
+        answers.append(user_data.pop("wait_admin_id", False))
+
+    async def main():
+        processor = bot.ChatOrderedProcessor(8)
+        await run_all(processor, [
+            (make_update(-1, 42), press_button()),
+            (make_update(-2, 42), send_id()),
+        ])
+
+    asyncio.run(main())
+    assert answers == [True]
+
+
+def test_backlog_counts_updates_in_progress():
+    async def main():
+        processor = bot.ChatOrderedProcessor(1)
+        app = SimpleNamespace(update_queue=asyncio.Queue(), update_processor=processor)
+        gate = asyncio.Event()
+
+        async def blocked():
+            await gate.wait()
+
+        task = asyncio.create_task(run_all(processor, [(make_update(-1, i), blocked()) for i in range(5)]))
+        await app.update_queue.put(object())
+        await asyncio.sleep(0.01)
+        assert bot.update_backlog(app) == 6
+        gate.set()
+        await task
+        assert bot.update_backlog(app) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+import asyncio
+from types import SimpleNamespace
+
+import bot
+
+AD = "Заработок от 5000 рублей в день без вложений, пишите в личку @richjob"
+
+
+def bits(a, b):
+    return bin(a ^ b).count("1")
+
+
+def feed(index, messages):
+    """messages: (text, chat_id, user_id); возвращает всё, что индекс велел удалить"""
+    found = []
+    for message_id, (text, chat_id, user_id) in enumerate(messages, 1):
+        found.extend(index.check(bot.normalize_text(text), chat_id, user_id, message_id) or [])
+    return found
+
+
+def test_simhash_ignores_case_punctuation_and_emoji():
+    a = bot.simhash(bot.normalize_text(AD))
+    b = bot.simhash(bot.normalize_text("🔥 " + AD.upper() + "!!!"))
+    other = bot.simhash(bot.normalize_text("Подскажите, пожалуйста, сколько идёт перевод на карту Тинькофф?"))
+    assert bits(a, b) <= bot.SPAM_DISTANCE
+    assert bits(a, other) > bot.SPAM_DISTANCE
+
+
+def test_bands_catch_every_fingerprint_within_distance():
+    index = bot.SpamIndex()
+    fp = bot.simhash(bot.normalize_text(AD))
+    keys = set(index.band_keys(fp))
+    for shift in range(0, 64 - bot.SPAM_DISTANCE, 7):
+        near = fp ^ (((1 << bot.SPAM_DISTANCE) - 1) << shift)
+        assert keys & set(index.band_keys(near))
+
+
+def test_broadcast_from_several_users_is_flagged():
+    index = bot.SpamIndex()
+    messages = [(AD + "!" * (i % 2), -1000 - i % 3, 100 + i) for i in range(bot.SPAM_MESSAGES)]
+    found = feed(index, messages)
+    assert len(found) == bot.SPAM_MESSAGES
+    # дальнейшие копии удаляются сразу
+    assert index.check(bot.normalize_text(AD), -1000, 999, 77) == [(-1000, 77)]
+
+
+def test_same_question_from_two_users_is_not_flagged():
+    index = bot.SpamIndex()
+    found = feed(index, [
+        ("Здравствуйте, подскажите как оплатить ChatGPT Plus?", -1001, 1),
+        ("Здравствуйте! Подскажите, как оплатить ChatGPT Plus", -1002, 2),
+    ])
+    assert found == []
+
+
+def test_one_user_repeating_is_not_a_broadcast():
+    index = bot.SpamIndex()
+    assert feed(index, [(AD, -1001, 1)] * (bot.SPAM_MESSAGES * 2)) == []
+
+
+def test_one_account_across_chats_is_flagged():
+    index = bot.SpamIndex()
+    messages = [(AD + "!" * (i % 2), -1000 - i, 1) for i in range(bot.SPAM_MESSAGES * 2)]
+    found = feed(index, messages)
+    assert len(found) == bot.SPAM_MESSAGES * 2
+
+
+def route(monkeypatch, messages):
+    """Прогоняет (text, chat_id, user_id) через text_router; возвращает (ответы, удалённые)"""
+    replies, deleted = [], []
+    monkeypatch.setattr(bot, "spam", bot.SpamIndex())
+    monkeypatch.setattr(bot.sender, "reply", lambda msg, text, **kw: replies.append(msg.message_id))
+
+    async def no_admins(bot_, chat, user_id):
+        return None
+
+    async def delete(bot_, found):
+        deleted.extend(message_id for chat_id, message_id in found)
+
+    monkeypatch.setattr(bot.chat_admins, "status", no_admins)
+    monkeypatch.setattr(bot, "delete_spam", delete)
+
+    for message_id, (text, chat_id, user_id) in enumerate(messages, 1):
+        msg = SimpleNamespace(text=text, chat_id=chat_id, message_id=message_id)
+        update = SimpleNamespace(
+            message=msg,
+            effective_chat=SimpleNamespace(id=chat_id),
+            effective_user=SimpleNamespace(id=user_id),
+        )
+        asyncio.run(bot.text_router(update, SimpleNamespace(user_data={}, bot=None)))
+    return replies, deleted
+
+
+def test_keyword_question_is_answered_not_deleted(monkeypatch):
+    text = "Здравствуйте, подскажите как оплатить ChatGPT Plus?"
+    replies, deleted = route(monkeypatch, [(text, -1001, 1), (text, -1001, 2), (text, -1001, 1)])
+    assert deleted == []
+    assert replies == [1, 2, 3]
+
+
+def test_keyword_does_not_hide_a_broadcast(monkeypatch):
+    text = AD + " Как оплатить - спросите там же"
+    count = bot.SPAM_MESSAGES + 2
+    replies, deleted = route(monkeypatch, [(text, -1000 - i, 100 + i) for i in range(count)])
+    # до порога на вопрос отвечают, на пороге рассылка удаляется целиком
+    assert replies == list(range(1, bot.SPAM_MESSAGES))
+    assert deleted == list(range(1, count + 1))